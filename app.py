@@ -1,56 +1,838 @@
 #!/usr/bin/env python3
-import requests #pip3 install requests
-import bs4 #pip3 install bs4
+import importlib # builtins
+import importlib.util # builtins
 import json # builtins
+import re # builtins
 import sys # For stderr
+import threading # builtins
+import contextlib # builtins
+import functools # builtins
+import gzip # builtins
+import hashlib # builtins
+import os # builtins
+import random # builtins
+import tempfile # builtins
+import time # builtins
+from collections import deque, namedtuple, OrderedDict # builtins
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED # builtins, for batch mode
+from urllib.parse import unquote, urlsplit # builtins
 
-def grab_source(username, headers=None):
-    url = f"https://linktr.ee/{username}"
+class _LazyModule:
+    # Stands in for a module and imports it the first time one of its
+    # attributes is used, so `app.py --help`, a single lookup or `import app`
+    # don't pay for requests, bs4 (and lxml) or aiohttp unless they need them.
+    # Setting an attribute (e.g. unittest.mock.patch) sets it on the module.
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+
+    def _module(self):
+        return importlib.import_module(self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._module(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._module(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._module(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+def _lazy_import(name, optional=False):
+    # Optional modules that aren't installed are None, as with try/import
+    if optional and importlib.util.find_spec(name) is None:
+        return None
+    return _LazyModule(name)
+
+requests = _lazy_import("requests") #pip3 install requests
+bs4 = _lazy_import("bs4") #pip3 install bs4
+asyncio = _lazy_import("asyncio") # builtins, only needed for the async API
+aiohttp = _lazy_import("aiohttp", optional=True) #pip3 install aiohttp (only needed for the async API)
+zstandard = _lazy_import("zstandard", optional=True) #pip3 install zstandard (only needed for zstd output)
+
+BASE_URL = "https://linktr.ee"
+DEFAULT_TIMEOUT = (5, 15) # (connect, read) in seconds
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONCURRENCY = 100
+STREAM_CHUNK_SIZE = 16 * 1024
+DEFAULT_CACHE_TTL = 60 * 60 # seconds
+DEFAULT_CACHE_MAX_SIZE = 512 * 1024 * 1024 # bytes
+DEFAULT_FLUSH_EVERY = 100 # records
+DEFAULT_RETRIES = 3
+DEFAULT_PORT = 8080
+DEFAULT_MEMORY_TTL = 5 * 60 # seconds
+DEFAULT_MEMORY_ENTRIES = 10000
+MAX_BATCH_USERNAMES = 1000
+DEFAULT_BACKOFF = 0.5 # seconds, doubled on every retry
+DEFAULT_MAX_BACKOFF = 60.0 # seconds
+DEFAULT_FLUSH_INTERVAL = 1.0 # seconds
+DEFAULT_MAX_FAILURES = 3 # failed requests in a row before an identity is quarantined
+DEFAULT_QUARANTINE = 60.0 # seconds
+
+# Fast path for finding the __NEXT_DATA__ payload without building a DOM.
+# Next.js escapes "<" inside the JSON, so the first "</script" after the
+# opening tag always ends it.
+_NEXT_DATA_START = r"""<script\b[^>]*?\bid\s*=\s*["']?__NEXT_DATA__\b["']?[^>]*>"""
+_SCRIPT_END = r"</script\s*>"
+_NEXT_DATA_PATTERNS = {
+    str: (re.compile(_NEXT_DATA_START, re.I), re.compile(_SCRIPT_END, re.I)),
+    bytes: (re.compile(_NEXT_DATA_START.encode(), re.I), re.compile(_SCRIPT_END.encode(), re.I)),
+}
+
+# Where the account object starts once "pageProps" has been found, for
+# decoding only that subtree of __NEXT_DATA__
+_ACCOUNT_KEY = re.compile(r'"account"\s*:\s*')
+_json_decoder = json.JSONDecoder()
+
+_session = None
+_session_lock = threading.Lock()
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+def _stdlib_functions():
+    return json.loads, _stdlib_dumps
+
+def _orjson_functions():
+    import orjson #pip3 install orjson (optional, faster JSON)
+    return orjson.loads, orjson.dumps
+
+def _ujson_functions():
+    import ujson #pip3 install ujson (optional, faster JSON)
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8")
+    return ujson.loads, dumps
+
+# name -> function returning (loads, dumps), in order of preference, or None
+# when the library isn't installed. dumps returns UTF-8 bytes. orjson and
+# ujson are only imported once selected, to keep startup light.
+JSON_BACKENDS = {
+    "orjson": _orjson_functions if importlib.util.find_spec("orjson") else None,
+    "ujson": _ujson_functions if importlib.util.find_spec("ujson") else None,
+    "json": _stdlib_functions,
+}
+json_backend = None # Name of the backend in use, see set_json_backend
+ACCOUNT_ONLY = False # Default for parse_next_data's account_only
+
+def set_json_backend(name="json"):
+    # Picks the JSON library used to decode __NEXT_DATA__ and encode output;
+    # "auto" is the fastest one installed. The default is the stdlib, whose
+    # output is the same as json.dumps and which keeps every integer exact.
+    global json_backend, _json_loads, _json_dumps
+    if name == "auto":
+        name = next(name for name, backend in JSON_BACKENDS.items() if backend is not None)
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if JSON_BACKENDS[name] is None:
+        raise RuntimeError(f"The {name} JSON backend needs {name}. Install it with: pip3 install {name}")
+    json_backend = name
+    _json_loads, _json_dumps = JSON_BACKENDS[name]()
+
+set_json_backend()
+
+def json_loads(data):
+    # data is str or UTF-8 bytes. orjson decodes integers that don't fit in
+    # 64 bits as floats, losing precision; only the json backend keeps them
+    # exact.
     try:
-        if headers:
-            r = requests.get(url, headers=headers)
-        else:
-            r = requests.get(url)
-        r.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
+        return _json_loads(data)
+    except ValueError:
+        if _json_loads is json.loads:
+            raise
+        return json.loads(data) # In case a backend rejects JSON the stdlib accepts
+
+def json_dumps(obj):
+    # Returns UTF-8 bytes
+    return _json_dumps(obj)
+
+def make_session(headers=None, pool_size=DEFAULT_POOL_SIZE):
+    # Keep-alive session whose pool holds at most pool_size connections per
+    # host; pool_block makes extra threads wait for a free connection instead
+    # of opening (and then throwing away) more of them.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+def get_session():
+    # Shared session used when grab_source isn't given one
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+class LinktreeError(Exception):
+    # Base class of every error raised while fetching or parsing a profile.
+    # username and status (the HTTP status code, if any) are set when known;
+    # exit_code is what main() exits with.
+    exit_code = 1
+
+    def __init__(self, message, username=None, status=None):
+        super().__init__(message)
+        self.username = username
+        self.status = status
+
+class FetchError(LinktreeError):
+    # Network errors, timeouts and HTTP errors without a more specific class
+    exit_code = 3
+
+class ProfileNotFound(FetchError):
+    exit_code = 4
+
+class RateLimited(FetchError):
+    # retry_after is the server's Retry-After in seconds, or None
+    exit_code = 5
+
+    def __init__(self, message, username=None, status=429, retry_after=None):
+        super().__init__(message, username=username, status=status)
+        self.retry_after = retry_after
+
+class StructureChanged(LinktreeError):
+    # The page has no __NEXT_DATA__ script or its JSON has no account
+    exit_code = 6
+
+class DecodeError(LinktreeError):
+    exit_code = 7
+
+def _parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        import email.utils # Imported here to keep startup light
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _http_error(username, status, headers, message):
+    if status == 404:
+        return ProfileNotFound(f"Profile not found: {username}", username=username, status=status)
+    if status == 429:
+        retry_after = _parse_retry_after(headers.get("Retry-After")) if headers else None
+        return RateLimited(f"Rate limited by linktr.ee: {message}", username=username, retry_after=retry_after)
+    return FetchError(f"Http Error: {message}", username=username, status=status)
+
+def is_transient(error):
+    # Errors worth retrying: rate limiting, server errors and network problems
+    if isinstance(error, RateLimited):
+        return True
+    return type(error) is FetchError and (error.status is None or error.status >= 500)
+
+class RetryPolicy:
+    # Retries transient errors with capped exponential backoff and full
+    # jitter. A RateLimited error's Retry-After is waited out instead, unless
+    # it is longer than max_backoff, in which case the error is given up on.
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, error, attempt):
+        if attempt >= self.retries or not is_transient(error):
+            return False
+        retry_after = getattr(error, "retry_after", None)
+        return retry_after is None or retry_after <= self.max_backoff
+
+    def delay(self, error, attempt):
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+class RateLimiter:
+    # Shared by all workers, used as a (async) context manager around each
+    # request. Combines a token bucket (rate requests per second, bursts of up
+    # to burst; rate=None means no rate limit) with an AIMD concurrency
+    # limit: a transient error halves the concurrency limit and the rate (at
+    # most once per decrease_interval, so a burst of failures counts once),
+    # and every `limit` successful requests in a row raise the limit by one
+    # and the rate by a tenth of the configured rate. A Retry-After pauses
+    # every worker until it has passed.
+
+    def __init__(self, rate=None, burst=None, max_concurrency=DEFAULT_POOL_SIZE, min_concurrency=1,
+                 decrease_interval=1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 1.0)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = max_concurrency
+        self.decrease_interval = decrease_interval
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self):
+        # Takes a concurrency slot and a token, returning 0; or returns the
+        # number of seconds to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._in_flight >= self.limit:
+                return 0.01
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+            self._in_flight += 1
+            return 0
+
+    def release(self, error=None):
+        with self._lock:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if error is None or not is_transient(error):
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    if self.rate:
+                        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+                return
+            self._successes = 0
+            retry_after = getattr(error, "retry_after", None)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                if self.rate:
+                    self.rate = max(self.max_rate / 32, self.rate / 2)
+
+    def __enter__(self):
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return self
+            time.sleep(wait)
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(exc)
+
+    async def __aenter__(self):
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return self
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release(exc)
+
+def is_identity_failure(error):
+    # Errors that say more about the identity a request was sent with than
+    # about the profile: transient ones, and being refused (403) or turned
+    # away by the proxy (407)
+    return is_transient(error) or (isinstance(error, FetchError) and error.status in (403, 407))
+
+class Identity:
+    # One egress identity: a header set and optionally a proxy, with its own
+    # connection pool (session) and RateLimiter, so throttling of one
+    # identity doesn't slow down the others
+    def __init__(self, name, headers=None, proxy=None, rate=None, burst=None, pool_size=DEFAULT_POOL_SIZE):
+        self.name = name
+        self.proxy = proxy
+        self.session = make_session(headers, pool_size=pool_size)
+        if proxy:
+            # Without trust_env, HTTP(S)_PROXY from the environment can't
+            # take precedence over the identity's own proxy
+            self.session.trust_env = False
+            self.session.proxies.update({"http": proxy, "https": proxy})
+        self.limiter = RateLimiter(rate=rate, burst=burst, max_concurrency=pool_size)
+        self.failures = 0 # in a row
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+        self.last_used = float("-inf")
+
+    def __repr__(self):
+        return f"<Identity {self.name!r}>"
+
+class IdentityPool:
+    # Spreads requests over identities, either round-robin or least recently
+    # used first. An identity whose requests fail max_failures times in a row
+    # (see is_identity_failure) is quarantined: left out for quarantine
+    # seconds, then tried again. If every identity is quarantined, acquire
+    # waits for the first one to come back.
+    STRATEGIES = ("round-robin", "lru")
+
+    def __init__(self, identities, strategy="round-robin", max_failures=DEFAULT_MAX_FAILURES,
+                 quarantine=DEFAULT_QUARANTINE, stats=None):
+        if not identities:
+            raise ValueError("An identity pool needs at least one identity")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown identity strategy: {strategy} (use one of: {', '.join(self.STRATEGIES)})")
+        self.identities = list(identities)
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.quarantine = quarantine
+        self.stats = stats
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _pick(self, now):
+        available = [identity for identity in self.identities if identity.quarantined_until <= now]
+        if not available:
+            return None
+        if self.strategy == "lru":
+            return min(available, key=lambda identity: identity.last_used)
+        for _ in range(len(self.identities)):
+            identity = self.identities[self._next]
+            self._next = (self._next + 1) % len(self.identities)
+            if identity.quarantined_until <= now:
+                return identity
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                identity = self._pick(now)
+                if identity is not None:
+                    identity.last_used = now
+                    return identity
+                wait = min(identity.quarantined_until for identity in self.identities) - now
+            time.sleep(wait)
+
+    def report(self, identity, error=None):
+        # Called with the outcome of every request sent with identity
+        with self._lock:
+            if error is None or not is_identity_failure(error):
+                identity.failures = 0
+                return
+            identity.failures += 1
+            if identity.failures < self.max_failures:
+                return
+            identity.failures = 0
+            identity.quarantines += 1
+            identity.quarantined_until = time.monotonic() + self.quarantine
+        _incr(self.stats, "quarantines")
+
+def make_identity_pool(config, headers=None, rate=None, pool_size=DEFAULT_POOL_SIZE, stats=None):
+    # Builds an IdentityPool from a parsed --identities file:
+    #   {"strategy": "round-robin" or "lru", "max_failures": 3, "quarantine": 60,
+    #    "identities": [{"name": ..., "headers": {...}, "proxy": "http://host:port",
+    #                    "rate": ..., "burst": ...}, ...]}
+    # or just the list of identities. Every key but an identity's headers or
+    # proxy is optional; headers are added to the given ones, and rate
+    # defaults to the given one (per identity).
+    if isinstance(config, list):
+        config = {"identities": config}
+    if not isinstance(config, dict) or not isinstance(config.get("identities"), list):
+        raise ValueError("The identities file needs a list of identities")
+    identities = []
+    for i, entry in enumerate(config["identities"]):
+        if not isinstance(entry, dict) or not (entry.get("headers") or entry.get("proxy")):
+            raise ValueError(f"Identity {i} needs headers or a proxy")
+        identities.append(Identity(
+            entry.get("name", str(i)),
+            headers={**(headers or {}), **entry.get("headers", {})},
+            proxy=entry.get("proxy"),
+            rate=entry.get("rate", rate),
+            burst=entry.get("burst"),
+            pool_size=pool_size,
+        ))
+    return IdentityPool(identities, strategy=config.get("strategy", "round-robin"),
+                        max_failures=config.get("max_failures", DEFAULT_MAX_FAILURES),
+                        quarantine=config.get("quarantine", DEFAULT_QUARANTINE), stats=stats)
+
+class Stats:
+    # Thread-safe counters and per-stage timers, to find out where the time
+    # goes. The stages are "fetch" (the request, including rate limiter
+    # waits and retries, and with stream/cache finding __NEXT_DATA__ while it
+    # downloads),
+    # "extract" (finding __NEXT_DATA__ in a whole page), "parse" (decoding it
+    # and building the profile) and "serialize" (encoding output records).
+    STAGES = ("fetch", "extract", "parse", "serialize")
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {stage: [0, 0.0, 0.0] for stage in self.STAGES} # stage -> [count, seconds, max seconds]
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self.counters), {stage: list(timer) for stage, timer in self.timers.items()}
+
+    def summary(self):
+        # Human readable, for --stats
+        counters, timers = self._snapshot()
+        lines = [f"{counters.get('profiles', 0)} profile(s), {counters.get('errors', 0)} error(s) "
+                 f"in {time.monotonic() - self.started:.2f}s",
+                 f"{'stage':<10} {'count':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for stage, (count, total, longest) in timers.items():
+            mean = total / count * 1000 if count else 0.0
+            lines.append(f"{stage:<10} {count:>8} {total:>10.3f} {mean:>10.2f} {longest * 1000:>10.2f}")
+        lines.extend(f"{name}: {value}" for name, value in sorted(counters.items()))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        # Prometheus text exposition format, for GET /metrics
+        counters, timers = self._snapshot()
+        lines = ["# HELP linktree_stage_seconds Time spent in each stage.",
+                 "# TYPE linktree_stage_seconds summary"]
+        for stage, (count, total, _) in timers.items():
+            lines.append(f'linktree_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'linktree_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines.append("# TYPE linktree_stage_seconds_max gauge")
+        for stage, (_, _, longest) in timers.items():
+            lines.append(f'linktree_stage_seconds_max{{stage="{stage}"}} {longest}')
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE linktree_{name}_total counter")
+            lines.append(f"linktree_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+def _incr(stats, name, n=1):
+    if stats is not None:
+        stats.incr(name, n)
+
+def _timer(stats, stage):
+    return stats.timer(stage) if stats is not None else contextlib.nullcontext()
+
+@contextlib.contextmanager
+def _request_errors(username):
+    try:
+        yield
     except requests.exceptions.HTTPError as errh:
-        print(f"Http Error: {errh}", file=sys.stderr)
-        sys.exit(1)
+        response = errh.response
+        raise _http_error(username, getattr(response, "status_code", None),
+                          getattr(response, "headers", None), errh) from errh
     except requests.exceptions.ConnectionError as errc:
-        print(f"Error Connecting: {errc}", file=sys.stderr)
-        sys.exit(1)
+        raise FetchError(f"Error Connecting: {errc}", username=username) from errc
     except requests.exceptions.Timeout as errt:
-        print(f"Timeout Error: {errt}", file=sys.stderr)
-        sys.exit(1)
+        raise FetchError(f"Timeout Error: {errt}", username=username) from errt
     except requests.exceptions.RequestException as err:
-        print(f"Oops: Something Else: {err}", file=sys.stderr)
-        sys.exit(1)
+        raise FetchError(f"Oops: Something Else: {err}", username=username) from err
+
+def _next_data_not_found(username=None):
+    raise StructureChanged("Could not find the __NEXT_DATA__ script tag in the HTML. "
+                           "This might indicate a change in Linktree page structure or a non-profile page.",
+                           username=username)
+
+def grab_source(username, headers=None, session=None, timeout=DEFAULT_TIMEOUT, limiter=None, stats=None,
+                as_bytes=False):
+    # Returns the page as text, or undecoded with as_bytes=True
+    if session is None:
+        session = get_session()
+    url = f"{BASE_URL}/{username}"
+    with limiter or contextlib.nullcontext(), _request_errors(username):
+        r = session.get(url, headers=headers, timeout=timeout)
+        r.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
+    _incr(stats, "bytes_fetched", len(r.content))
     # This line should only be reached if no exceptions occurred
-    return r.text
+    return r.content if as_bytes else r.text
+
+def grab_next_data(username, headers=None, session=None, timeout=DEFAULT_TIMEOUT,
+                   chunk_size=STREAM_CHUNK_SIZE, cache=None, limiter=None, stats=None):
+    # Streaming alternative to grab_source: reads the page in chunks and
+    # closes the response as soon as the __NEXT_DATA__ script has ended.
+    # Returns only the raw JSON payload as bytes; the page is never decoded.
+    # With a ResponseCache, fresh entries are returned without a request and
+    # stale ones are revalidated with If-None-Match/If-Modified-Since.
+    cached = cache.get(username) if cache is not None else None
+    if cached is not None:
+        if cache.is_fresh(cached):
+            _incr(stats, "cache_hits")
+            return cached.payload
+        headers = {**(headers or {}), **cache.validators(cached)}
+    if session is None:
+        session = get_session()
+    url = f"{BASE_URL}/{username}"
+    extractor = NextDataExtractor()
+    with limiter or contextlib.nullcontext(), _request_errors(username):
+        with session.get(url, headers=headers, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            if r.status_code == 304 and cached is not None:
+                _incr(stats, "cache_revalidated")
+                cache.put(username, cached.payload, cached.etag, cached.last_modified)
+                return cached.payload
+            if cache is not None:
+                _incr(stats, "cache_misses")
+            for chunk in r.iter_content(chunk_size):
+                _incr(stats, "bytes_fetched", len(chunk))
+                payload = extractor.feed(chunk)
+                if payload is not None:
+                    if cache is not None:
+                        cache.put(username, payload, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+                    return payload
+    _next_data_not_found(username)
+
+class NextDataExtractor:
+    # Incremental extract_next_data for a page arriving as byte chunks. Bytes
+    # before the opening tag are dropped as soon as they have been scanned,
+    # so only the payload itself is ever held in memory.
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._in_payload = False
+        self.payload = None
+
+    def feed(self, chunk):
+        # Returns the payload once the closing </script> has been seen, else None
+        if self.payload is not None:
+            return self.payload
+        start_re, end_re = _NEXT_DATA_PATTERNS[bytes]
+        resume = len(self._buf)
+        self._buf += chunk
+        # A tag split across chunks can only start at the last "<" seen so
+        # far; without one, the bytes already scanned needn't be scanned again
+        last_lt = self._buf.rfind(b"<", 0, resume)
+        if last_lt >= 0:
+            resume = last_lt
+        if not self._in_payload:
+            start = start_re.search(self._buf, resume)
+            if not start:
+                keep = self._buf.rfind(b"<")
+                del self._buf[:keep if keep >= 0 else len(self._buf)]
+                return None
+            del self._buf[:start.end()]
+            self._in_payload = True
+            resume = 0
+        end = end_re.search(self._buf, resume)
+        if end:
+            self.payload = bytes(self._buf[:end.start()])
+            self._buf = bytearray()
+        return self.payload
+
+CacheEntry = namedtuple("CacheEntry", ["payload", "etag", "last_modified", "fetched_at"])
+
+class ResponseCache:
+    # On-disk cache of __NEXT_DATA__ payloads keyed by username. Each entry is
+    # one file: a JSON metadata line followed by the raw payload. Reads bump
+    # the file's mtime, and once the directory grows past max_size the least
+    # recently used entries are evicted. bypass=True ignores existing entries
+    # (every profile is fetched again) but still stores the fresh responses.
+
+    def __init__(self, directory, ttl=DEFAULT_CACHE_TTL, max_size=DEFAULT_CACHE_MAX_SIZE, bypass=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return (entry for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(".entry"))
+
+    def _path(self, username):
+        # linktr.ee usernames are case-insensitive
+        key = hashlib.sha1(username.lower().encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key + ".entry")
 
-def parse_html(source):
+    def get(self, username):
+        if self.bypass:
+            return None
+        path = self._path(username)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                payload = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(payload, meta.get("etag"), meta.get("last_modified"), meta.get("fetched_at", 0))
+
+    def is_fresh(self, entry):
+        return time.time() - entry.fetched_at < self.ttl
+
+    def validators(self, entry):
+        # Headers for a conditional request revalidating entry
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def put(self, username, payload, etag=None, last_modified=None):
+        path = self._path(username)
+        meta = {"username": username, "etag": etag, "last_modified": last_modified, "fetched_at": time.time()}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(meta).encode("utf-8") + b"\n")
+            f.write(payload)
+            size = f.tell()
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path) # Atomic, readers never see a partial entry
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until 90% of max_size, so eviction
+        # (a directory scan) doesn't run again on the very next put
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+
+def extract_next_data(source):
+    # Returns the raw text of the __NEXT_DATA__ script (same type as source,
+    # str or bytes) by scanning the page, or None if it can't be found.
+    start_re, end_re = _NEXT_DATA_PATTERNS[bytes if isinstance(source, (bytes, bytearray)) else str]
+    start = start_re.search(source)
+    if not start:
+        return None
+    end = end_re.search(source, start.end())
+    if not end:
+        return None
+    return source[start.end():end.start()]
+
+def parse_html(source, fields=None):
     if source is None:
-        print("Error: No source HTML provided to parse.", file=sys.stderr)
-        sys.exit(1)
+        raise LinktreeError("No source HTML provided to parse.")
+    return parse_next_data(_find_next_data(source), fields=fields)
 
-    soup = bs4.BeautifulSoup(source, 'lxml')
-    next_data_script = soup.find('script', {'crossorigin':'anonymous', 'id':"__NEXT_DATA__"})
+def _find_next_data(source):
+    payload = extract_next_data(source)
+    if payload is None:
+        # Fall back to a full parse for markup the fast path doesn't recognise
+        soup = bs4.BeautifulSoup(source, 'lxml')
+        next_data_script = soup.find('script', {'crossorigin':'anonymous', 'id':"__NEXT_DATA__"})
 
-    if not next_data_script:
-        print("Error: Could not find the __NEXT_DATA__ script tag in the HTML.", file=sys.stderr)
-        print("This might indicate a change in Linktree page structure or a non-profile page.", file=sys.stderr)
-        sys.exit(1)
+        if not next_data_script:
+            _next_data_not_found()
+        payload = next_data_script.text
+    return payload
 
+def _decode_account(payload):
+    # Decodes only the object after the first "account" key following
+    # "pageProps", so the rest of __NEXT_DATA__ (page config, theme,
+    # analytics) is never turned into Python objects. That is
+    # props.pageProps.account in every page seen so far; anything that
+    # doesn't look like an account returns None.
     try:
-        data = json.loads(next_data_script.text)
-    except json.JSONDecodeError:
-        print("Error: Could not decode JSON from __NEXT_DATA__ script tag.", file=sys.stderr)
-        sys.exit(1)
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode("utf-8")
+        page_props = payload.find('"pageProps"')
+        if page_props < 0:
+            return None
+        key = _ACCOUNT_KEY.search(payload, page_props)
+        if not key:
+            return None
+        account, _ = _json_decoder.raw_decode(payload, key.end())
+    except ValueError:
+        return None
+    if not isinstance(account, dict) or "username" not in account:
+        return None
+    return account
 
-    try:
-        account_data = data['props']['pageProps']['account']
-    except KeyError:
-        print("Error: Unexpected JSON structure in __NEXT_DATA__. Could not find 'props.pageProps.account'.", file=sys.stderr)
-        sys.exit(1)
+def compile_fields(fields):
+    # Turns a field selection such as "username,links.id,links.type,socialLinks"
+    # (or a list of those names) into a function that picks them out of a
+    # decoded account. A name copies that key of the account as it is; a
+    # dotted name descends into it, into each item when it is a list, so
+    # "links.id,links.type" gives [{"id": ..., "type": ...}, ...]. Missing
+    # keys come out as None, and username is always included.
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    return _compile_fields(tuple(field.strip() for field in fields if field.strip()))
+
+@functools.lru_cache(maxsize=32)
+def _compile_fields(fields):
+    tree = {"username": {}}
+    for field in fields:
+        node = tree
+        for part in field.split("."):
+            if not part:
+                raise ValueError(f"Invalid field: {field!r}")
+            node = node.setdefault(part, {})
+    project = _compile_projection(tree)
+    project.selection = ",".join(fields) # Identifies the selection, see _check_state
+    return project
+
+def _compile_projection(tree):
+    selected = [(key, _compile_projection(subtree) if subtree else None) for key, subtree in tree.items()]
+
+    def project(value):
+        if isinstance(value, list):
+            return [project(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for key, sub in selected:
+            item = value.get(key)
+            result[key] = item if sub is None or item is None else sub(item)
+        return result
+    return project
+
+def parse_next_data(payload, account_only=None, fields=None):
+    # Builds the profile info from the JSON text of the __NEXT_DATA__ script.
+    # With account_only (default: ACCOUNT_ONLY) only the account object is
+    # decoded, falling back to the whole payload when it can't be found.
+    # That takes the stdlib decoder, so with another backend, whose full
+    # decode is faster, account_only has no effect. fields (a selection for
+    # compile_fields, or its result) replaces the default info with those
+    # fields of the account.
+    if account_only is None:
+        account_only = ACCOUNT_ONLY
+    account_data = _decode_account(payload) if account_only and json_backend == "json" else None
+    if account_data is None:
+        try:
+            data = json_loads(payload)
+        except ValueError as e: # Includes UnicodeDecodeError
+            raise DecodeError(f"Could not decode JSON from __NEXT_DATA__ script tag: {e}") from e
+
+        try:
+            account_data = data['props']['pageProps']['account']
+        except (KeyError, TypeError) as e:
+            raise StructureChanged("Unexpected JSON structure in __NEXT_DATA__. Could not find 'props.pageProps.account'.") from e
+        if not isinstance(account_data, dict):
+            raise StructureChanged("Unexpected JSON structure in __NEXT_DATA__. 'props.pageProps.account' is not an object.")
+
+    if fields is not None:
+        if not callable(fields):
+            fields = compile_fields(fields)
+        return fields(account_data)
 
     keys = [
         "username",
@@ -72,14 +854,994 @@ def parse_html(source):
                 print(f"Warning: Skipping malformed link item: {link}", file=sys.stderr)
     return info
 
-if __name__ == "__main__":
+# The fields of a profile that change detection compares, unless a field
+# selection decides what the profile is
+PROFILE_FIELDS = ("username", "description", "profilePictureUrl", "links")
+
+StateEntry = namedtuple("StateEntry", ["raw_hash", "info_hash", "info"])
+
+class StateStore:
+    # SQLite database remembering every scraped profile, so later runs can
+    # tell which profiles are new, changed or removed. For each username it
+    # keeps a hash of the raw __NEXT_DATA__ payload (an identical payload
+    # doesn't need parsing again), a hash of the compared fields of the
+    # profile and those fields themselves. Changes are committed every
+    # commit_every updates and on close. With commit_every=None they are held
+    # back until commit() names their usernames, so a batch run only
+    # remembers profiles whose output is on disk (see JSONLinesWriter);
+    # close() then drops the rest.
+
+    def __init__(self, path, commit_every=100):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self._staged = {} # lowercased username -> row or None (removed), with commit_every=None
+        self._lock = threading.Lock()
+        import sqlite3 # Imported here to keep startup light
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS profiles ("
+                         "username TEXT PRIMARY KEY, raw_hash TEXT, info_hash TEXT NOT NULL, "
+                         "info TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._db.commit()
+
+    def get(self, username):
+        key = username.lower()
+        with self._lock:
+            if key in self._staged:
+                row = self._staged[key]
+            else:
+                row = self._db.execute("SELECT raw_hash, info_hash, info FROM profiles WHERE username = ?",
+                                       (key,)).fetchone()
+        if row is None:
+            return None
+        return StateEntry(row[0], row[1], json.loads(row[2]))
+
+    def unchanged(self, username, raw_hash):
+        # The stored profile if its __NEXT_DATA__ payload hashed to raw_hash, else None
+        entry = self.get(username)
+        if entry is None or entry.raw_hash != raw_hash:
+            return None
+        return entry.info
+
+    def record(self, username, info, raw_hash=None, fields=PROFILE_FIELDS):
+        # Stores the profile's fields and returns (change, diff): change is
+        # "new", "changed" or "unchanged", and diff (for "changed" only) is
+        # {"fields": [...], "links_added": [...], "links_removed": [...]}.
+        info = {field: info.get(field) for field in fields}
+        encoded = json.dumps(info, sort_keys=True)
+        info_hash = hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+        previous = self.get(username)
+        if previous is None:
+            change, diff = "new", None
+        elif previous.info_hash == info_hash:
+            change, diff = "unchanged", None
+        else:
+            change, diff = "changed", profile_diff(previous.info, info, fields)
+        if previous is None or (previous.info_hash, previous.raw_hash) != (info_hash, raw_hash):
+            self._update(username.lower(), (raw_hash, info_hash, encoded))
+        return change, diff
+
+    def remove(self, username):
+        # Forgets a profile that no longer exists; returns whether it was known
+        if self.get(username) is None:
+            return False
+        self._update(username.lower(), None)
+        return True
+
+    def commit(self, usernames=None):
+        # Commits the held back changes of usernames (default: all of them)
+        with self._lock:
+            keys = list(self._staged) if usernames is None else [username.lower() for username in usernames]
+            for key in keys:
+                if key in self._staged:
+                    self._write(key, self._staged.pop(key))
+            self._db.commit()
+            self._pending = 0
+
+    def _update(self, key, row):
+        with self._lock:
+            if self.commit_every is None:
+                self._staged[key] = row
+                return
+            self._write(key, row)
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._db.commit()
+                self._pending = 0
+
+    def _write(self, key, row):
+        # row is (raw_hash, info_hash, info), or None to delete the profile
+        if row is None:
+            self._db.execute("DELETE FROM profiles WHERE username = ?", (key,))
+        else:
+            self._db.execute("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?)", (key, *row, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def profile_diff(old, new, fields=PROFILE_FIELDS):
+    # What changed between two versions of a profile
+    old_links, new_links = old.get("links") or [], new.get("links") or []
+    return {
+        "fields": [field for field in dict.fromkeys([*fields, *old]) if old.get(field) != new.get(field)],
+        "links_added": [link for link in new_links if link not in old_links],
+        "links_removed": [link for link in old_links if link not in new_links],
+    }
+
+def _check_state(state, username, source, payload, fields=None):
+    # Hashes the __NEXT_DATA__ payload of a fetched page (extracting it from
+    # a whole page first), together with the field selection if there is
+    # one, since the stored profile has that selection's shape. Returns
+    # (source, payload, raw_hash, unchanged): unchanged is the profile to
+    # emit without parsing when both are the same as last time, and an
+    # extracted payload replaces the page as source so it isn't searched
+    # twice.
+    if not payload:
+        extracted = extract_next_data(source)
+        if extracted is None:
+            return source, payload, None, None # Leave it to parse_html's fallback
+        source, payload = extracted, True
+    raw = source.encode("utf-8") if isinstance(source, str) else source
+    digest = hashlib.sha1(raw)
+    if fields is not None:
+        selection = fields if callable(fields) else compile_fields(fields)
+        digest.update(b"\0" + selection.selection.encode("utf-8"))
+    raw_hash = digest.hexdigest()
+    info = state.unchanged(username, raw_hash)
+    if info is None:
+        return source, payload, raw_hash, None
+    return source, payload, raw_hash, {**info, "change": "unchanged"}
+
+def _record_change(state, username, data, raw_hash, fields=None):
+    # With a field selection, the selected fields (all of data) are compared
+    change, diff = state.record(username, data, raw_hash, PROFILE_FIELDS if fields is None else tuple(data))
+    data["change"] = change
+    if diff is not None:
+        data["diff"] = diff
+    return data
+
+def _removed(state, username):
+    # Record for a profile that was known but now doesn't exist, or None
+    if state is not None and state.remove(username):
+        return {"username": username, "change": "removed"}
+    return None
+
+@contextlib.contextmanager
+def _errors_for(username):
+    # Parse errors don't know which profile they came from; fill it in
+    try:
+        yield
+    except LinktreeError as e:
+        if e.username is None:
+            e.username = username
+        raise
+
+def _parse_source(source, payload=False, timed=False, fields=None):
+    # parse_next_data for a raw __NEXT_DATA__ payload, parse_html for a page.
+    # Returns (info, timings); with timed=True, timings holds the seconds
+    # spent in the extract and parse stages. Module level, so it can run in
+    # a ProcessPoolExecutor.
+    if not timed:
+        return (parse_next_data(source, fields=fields) if payload else parse_html(source, fields=fields)), {}
+    start = time.perf_counter()
+    if not payload:
+        if source is None:
+            raise LinktreeError("No source HTML provided to parse.")
+        source = _find_next_data(source)
+    extracted = time.perf_counter()
+    info = parse_next_data(source, fields=fields)
+    return info, {"extract": extracted - start, "parse": time.perf_counter() - extracted}
+
+def _record_timings(data, timings, stats, timing):
+    if stats is not None:
+        stats.incr("profiles")
+        for stage, seconds in timings.items():
+            stats.observe(stage, seconds)
+    if timing:
+        data["timing"] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()} # ms
+    return data
+
+def fetch(username, stream=False, cache=None, retry=None, stats=None, identities=None, **kwargs):
+    # The network half of scrape: returns the page (bytes with as_bytes=True)
+    # or, with stream or a cache, the raw __NEXT_DATA__ payload. kwargs are
+    # passed on to grab_source/grab_next_data (headers, session, timeout,
+    # limiter). With a RetryPolicy, transient fetch errors are retried. With
+    # an IdentityPool, every attempt is sent with the session and limiter of
+    # the identity it hands out, so a retry may go out as another identity.
+    if stats is not None:
+        kwargs["stats"] = stats
+    attempt = 0
+    while True:
+        identity = identities.acquire() if identities is not None else None
+        if identity is not None:
+            kwargs.update(session=identity.session, limiter=identity.limiter)
+        try:
+            if cache is not None:
+                source = grab_next_data(username, cache=cache, **kwargs)
+            elif stream:
+                source = grab_next_data(username, **kwargs)
+            else:
+                source = grab_source(username, **kwargs)
+            if identity is not None:
+                identities.report(identity)
+            return source
+        except LinktreeError as e:
+            if identity is not None:
+                identities.report(identity, e)
+            if retry is None or not retry.should_retry(e, attempt):
+                _incr(stats, "errors")
+                raise
+            _incr(stats, "retries")
+            time.sleep(retry.delay(e, attempt))
+            attempt += 1
+
+def _timed_fetch(username, **kwargs):
+    start = time.perf_counter()
+    source = fetch(username, **kwargs)
+    return source, time.perf_counter() - start
+
+def scrape(username, stream=False, cache=None, retry=None, stats=None, timing=False, state=None, fields=None,
+           **kwargs):
+    # fetch, then parse. The cache stores __NEXT_DATA__ payloads, so it
+    # implies stream. Stage timings and counters are recorded in stats (a
+    # Stats), and timing=True adds the profile's own stage timings to it as
+    # "timing". With a StateStore, the profile gets a "change" field ("new",
+    # "changed" with a "diff", or "unchanged"; an unchanged payload isn't
+    # parsed at all), and a known profile that is gone comes back as
+    # {"username": ..., "change": "removed"} instead of ProfileNotFound.
+    # fields selects the output fields, see compile_fields.
+    payload = stream or cache is not None
+    try:
+        source, fetched = _timed_fetch(username, stream=stream, cache=cache, retry=retry, stats=stats, **kwargs)
+    except ProfileNotFound:
+        removed = _removed(state, username)
+        if removed is None:
+            raise
+        return removed
+    raw_hash = None
+    if state is not None:
+        source, payload, raw_hash, unchanged = _check_state(state, username, source, payload, fields)
+        if unchanged is not None:
+            _incr(stats, "parses_skipped")
+            return unchanged
+    try:
+        with _errors_for(username):
+            data, timings = _parse_source(source, payload=payload, timed=stats is not None or timing,
+                                          fields=fields)
+    except LinktreeError:
+        _incr(stats, "errors")
+        raise
+    if state is not None:
+        _record_change(state, username, data, raw_hash, fields)
+    return _record_timings(data, {"fetch": fetched, **timings}, stats, timing)
+
+def read_usernames(fileobj):
+    # One username per line; blank lines and "#" comments are ignored
+    for line in fileobj:
+        username = line.strip()
+        if username and not username.startswith("#"):
+            yield username
+
+def scrape_many(usernames, workers=8, **kwargs):
+    # Yields (username, data, error) tuples in completion order. Only
+    # workers * 2 profiles are submitted at a time, so a huge username list
+    # is consumed lazily instead of being queued into the pool up front.
+    usernames = iter(usernames)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for username in usernames:
+                pending[pool.submit(scrape, username, **kwargs)] = username
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                username = pending.pop(future)
+                try:
+                    result = (username, future.result(), None)
+                except Exception as e:
+                    result = (username, None, e)
+                yield result
+
+def _init_parse_worker(backend, account_only):
+    # Parse processes start from a fresh import of this module
+    global ACCOUNT_ONLY
+    set_json_backend(backend)
+    ACCOUNT_ONLY = account_only
+
+def make_parse_pool(workers=None):
+    # Process pool for parsing pages. Its processes are started by a fork
+    # server (or spawned) rather than forked from this process, whose
+    # fetching threads may hold locks at the time.
+    import multiprocessing # Imported here to keep startup light
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                               initializer=_init_parse_worker, initargs=(json_backend, ACCOUNT_ONLY))
+
+def pipeline_scrape_many(usernames, fetch_workers=8, parse_workers=None, queue_size=None,
+                         stream=False, cache=None, stats=None, timing=False, state=None, fields=None,
+                         **kwargs):
+    # Same results as scrape_many, but the parsing runs in parse_workers
+    # processes (default: one per core) so it isn't held to one core by the
+    # GIL. fetch_workers threads fetch the raw page bytes (or, with stream or
+    # a cache, only the __NEXT_DATA__ payload) and hand them to the process
+    # pool as they are. Both stages are bounded: at most fetch_workers * 2
+    # profiles are being fetched or waiting for a parser, and at most
+    # queue_size (default: parse_workers * 2) are queued for the parsers, so
+    # a slow stage holds up the one before it instead of piling up pages.
+    # kwargs are passed on to fetch (headers, session, timeout, limiter, retry).
+    # state and fields work as in scrape; unchanged payloads never reach the
+    # parsers.
+    parse_workers = parse_workers or os.cpu_count() or 1
+    queue_size = queue_size or parse_workers * 2
+    payload = stream or cache is not None
+    timed = stats is not None or timing
+    if not payload:
+        kwargs["as_bytes"] = True
+    if fields is not None and not isinstance(fields, str):
+        fields = tuple(fields) # Sent to the parsers, so not compiled here
+    usernames = iter(usernames)
+    fetching = {} # future -> username
+    fetched = deque() # (username, source, payload, raw hash, fetch seconds) waiting for a parser
+    parsing = {} # future -> (username, raw hash, fetch seconds)
+    with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, make_parse_pool(parse_workers) as parse_pool:
+        while True:
+            while len(fetching) + len(fetched) < fetch_workers * 2:
+                username = next(usernames, None)
+                if username is None:
+                    break
+                fetching[io_pool.submit(_timed_fetch, username, stream=stream, cache=cache,
+                                        stats=stats, **kwargs)] = username
+            while fetched and len(parsing) < queue_size:
+                username, source, is_payload, raw_hash, fetch_seconds = fetched.popleft()
+                parsing[parse_pool.submit(_parse_source, source, is_payload, timed, fields)] = (username, raw_hash, fetch_seconds)
+            if not fetching and not parsing:
+                return
+            done, _ = wait([*fetching, *parsing], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in fetching:
+                    username = fetching.pop(future)
+                    try:
+                        source, fetch_seconds = future.result()
+                    except Exception as e:
+                        removed = _removed(state, username) if isinstance(e, ProfileNotFound) else None
+                        yield (username, removed, None) if removed is not None else (username, None, e)
+                        continue
+                    is_payload, raw_hash = payload, None
+                    if state is not None:
+                        source, is_payload, raw_hash, unchanged = _check_state(state, username, source, payload, fields)
+                        if unchanged is not None:
+                            _incr(stats, "parses_skipped")
+                            yield (username, unchanged, None)
+                            continue
+                    fetched.append((username, source, is_payload, raw_hash, fetch_seconds))
+                    continue
+                username, raw_hash, fetch_seconds = parsing.pop(future)
+                try:
+                    with _errors_for(username):
+                        data, timings = future.result()
+                except Exception as e:
+                    _incr(stats, "errors")
+                    yield (username, None, e)
+                    continue
+                if state is not None:
+                    _record_change(state, username, data, raw_hash, fields)
+                yield (username, _record_timings(data, {"fetch": fetch_seconds, **timings}, stats, timing), None)
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise RuntimeError("The async API needs aiohttp. Install it with: pip3 install aiohttp")
+
+def make_async_session(headers=None, pool_size=DEFAULT_CONCURRENCY):
+    # aiohttp counterpart of make_session; must be called with a running event loop
+    _require_aiohttp()
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+    return aiohttp.ClientSession(connector=connector, headers=headers)
+
+@contextlib.contextmanager
+def _aiohttp_errors(username):
+    try:
+        yield
+    except aiohttp.ClientResponseError as errh:
+        raise _http_error(username, errh.status, errh.headers, errh) from errh
+    except aiohttp.ClientConnectionError as errc:
+        raise FetchError(f"Error Connecting: {errc}", username=username) from errc
+    except asyncio.TimeoutError as errt:
+        raise FetchError(f"Timeout Error: {errt}", username=username) from errt
+    except aiohttp.ClientError as err:
+        raise FetchError(f"Oops: Something Else: {err}", username=username) from err
+
+async def async_grab_source(username, session=None, headers=None, timeout=DEFAULT_TIMEOUT,
+                            stream=False, cache=None, limiter=None, stats=None):
+    # With stream=True (implied by cache) this is the async grab_next_data:
+    # it returns the raw __NEXT_DATA__ payload as bytes and stops reading
+    # once it has ended.
+    _require_aiohttp()
+    cached = cache.get(username) if cache is not None else None
+    if cached is not None and cache.is_fresh(cached):
+        _incr(stats, "cache_hits")
+        return cached.payload
+    owns_session = session is None
+    if owns_session:
+        session = make_async_session(headers)
+        headers = None # Already on the session
+    if cached is not None:
+        headers = {**(headers or {}), **cache.validators(cached)}
+    url = f"{BASE_URL}/{username}"
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    try:
+        async with limiter or contextlib.nullcontext():
+            with _aiohttp_errors(username):
+                async with session.get(url, headers=headers, timeout=client_timeout) as r:
+                    r.raise_for_status()
+                    if r.status == 304 and cached is not None:
+                        _incr(stats, "cache_revalidated")
+                        cache.put(username, cached.payload, cached.etag, cached.last_modified)
+                        return cached.payload
+                    if cache is not None:
+                        _incr(stats, "cache_misses")
+                    if not stream and cache is None:
+                        body = await r.read()
+                        _incr(stats, "bytes_fetched", len(body))
+                        return body.decode(r.get_encoding())
+                    extractor = NextDataExtractor()
+                    async for chunk in r.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        _incr(stats, "bytes_fetched", len(chunk))
+                        payload = extractor.feed(chunk)
+                        if payload is not None:
+                            r.close()
+                            if cache is not None:
+                                cache.put(username, payload, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+                            return payload
+        _next_data_not_found(username)
+    finally:
+        if owns_session:
+            await session.close()
+
+async def async_scrape(username, semaphore=None, executor=None, retry=None, stats=None, timing=False,
+                       state=None, fields=None, **kwargs):
+    # kwargs are passed on to async_grab_source. The semaphore only guards the
+    # fetch; parse_html runs in executor (default: the loop's thread pool, or
+    # pass a ProcessPoolExecutor to use more cores) so it never blocks the loop.
+    # With a RetryPolicy, transient fetch errors are retried. stats, timing,
+    # state and fields work as in scrape (pass fields uncompiled with a
+    # ProcessPoolExecutor).
+    if stats is not None:
+        kwargs["stats"] = stats
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            async with semaphore or contextlib.nullcontext():
+                source = await async_grab_source(username, **kwargs)
+            fetched = time.perf_counter() - start
+            break
+        except LinktreeError as e:
+            if retry is None or not retry.should_retry(e, attempt):
+                _incr(stats, "errors")
+                removed = _removed(state, username) if isinstance(e, ProfileNotFound) else None
+                if removed is None:
+                    raise
+                return removed
+            _incr(stats, "retries")
+            await asyncio.sleep(retry.delay(e, attempt))
+            attempt += 1
+    payload = bool(kwargs.get("stream")) or kwargs.get("cache") is not None
+    raw_hash = None
+    if state is not None:
+        source, payload, raw_hash, unchanged = _check_state(state, username, source, payload, fields)
+        if unchanged is not None:
+            _incr(stats, "parses_skipped")
+            return unchanged
+    loop = asyncio.get_running_loop()
+    try:
+        with _errors_for(username):
+            data, timings = await loop.run_in_executor(executor, _parse_source, source, payload,
+                                                       stats is not None or timing, fields)
+    except LinktreeError:
+        _incr(stats, "errors")
+        raise
+    if state is not None:
+        _record_change(state, username, data, raw_hash, fields)
+    return _record_timings(data, {"fetch": fetched, **timings}, stats, timing)
+
+async def _async_scrape_result(username, **kwargs):
+    try:
+        return (username, await async_scrape(username, **kwargs), None)
+    except Exception as e:
+        return (username, None, e)
+
+async def async_scrape_many(usernames, concurrency=DEFAULT_CONCURRENCY, headers=None, **kwargs):
+    # Async generator yielding (username, data, error) tuples in completion
+    # order, with the same lazy consumption of usernames as scrape_many.
+    # kwargs are passed on to async_scrape (executor, timeout, stream, cache,
+    # limiter, retry).
+    semaphore = asyncio.Semaphore(concurrency)
+    usernames = iter(usernames)
+    pending = set()
+    async with make_async_session(headers, pool_size=concurrency) as session:
+        try:
+            while True:
+                for username in usernames:
+                    pending.add(asyncio.ensure_future(_async_scrape_result(
+                        username, session=session, semaphore=semaphore, **kwargs)))
+                    if len(pending) >= concurrency * 2:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending: # Consumer stopped early
+                task.cancel()
+
+def error_record(username, error):
+    # How a failed profile is reported in batch output and by the API server
+    return {
+        "username": username,
+        "status": "error",
+        "error": str(error) or repr(error),
+        "error_type": type(error).__name__,
+        "http_status": getattr(error, "status", None),
+    }
+
+class CheckpointJournal:
+    # Append-only record of the usernames a batch run has finished, so a
+    # restarted run can skip them. Each line stands for one flush of the
+    # output: {"offset": output size after the flush, "done": [[username,
+    # status], ...]}. A line is only appended once the output it describes is
+    # on disk, and a resumed run cuts the output back to the last journaled
+    # offset, so records written after it (whose usernames aren't journaled
+    # and will be scraped again) are neither lost nor duplicated.
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {} # username -> "ok", "error" or "skipped"
+        self.offset = 0
+        self._load()
+        self._file = open(path, "ab")
+
+    def _load(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        valid = 0
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    offset, done = entry["offset"], entry["done"]
+                except (ValueError, KeyError, TypeError):
+                    break # Torn by a crash mid-write; everything after it is redone
+                self.offset = offset
+                self.done.update(done)
+                valid += len(line)
+        os.truncate(self.path, valid)
+
+    def append(self, done, offset):
+        self._file.write(json.dumps({"offset": offset, "done": done}).encode("utf-8") + b"\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.offset = offset
+
+    def resume(self, outfile):
+        # Cuts a (binary, uncompressed) output file back to the journaled offset
+        outfile.flush()
+        outfile.truncate(self.offset)
+        outfile.seek(self.offset)
+
+    def close(self):
+        self._file.close()
+
+class JSONLinesWriter:
+    # Writes one JSON object per line to a binary stream (text streams such as
+    # sys.stdout are written through their .buffer). Encoded lines are
+    # buffered and written out every flush_every records or flush_interval
+    # seconds, whichever comes first; nothing else is kept in memory.
+    # compression is None, "gzip" or "zstd" (needs zstandard). With a
+    # CheckpointJournal (uncompressed output to a file only), the usernames
+    # given to write, write_error and skip are journaled after each flush,
+    # and then their changes to state (a StateStore) are committed.
+
+    def __init__(self, stream, compression=None, flush_every=DEFAULT_FLUSH_EVERY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, stats=None, journal=None, state=None):
+        if journal is not None and compression is not None:
+            raise ValueError("A checkpoint journal needs uncompressed output")
+        self._raw = getattr(stream, "buffer", stream)
+        if compression == "gzip":
+            self._out = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstd output needs zstandard. Install it with: pip3 install zstandard")
+            self._out = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        elif compression is None:
+            self._out = self._raw
+        else:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compression = compression
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.journal = journal
+        self.state = state
+        self._pending = []
+        self._done = [] # [username, status] to journal after the next flush
+        self._last_flush = time.monotonic()
+
+    def write(self, record, username=None, status="ok"):
+        with _timer(self.stats, "serialize"):
+            line = json_dumps(record) + b"\n"
+        _incr(self.stats, "bytes_serialized", len(line))
+        self._pending.append(line)
+        if username is not None:
+            self._done.append([username, status])
+        if (len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def write_error(self, username, error):
+        self.write(error_record(username, error), username, "error")
+
+    def skip(self, username):
+        # Marks a username as done without writing anything for it
+        self._done.append([username, "skipped"])
+
+    def flush(self):
+        if self._pending:
+            self._out.write(b"".join(self._pending))
+            self._pending = []
+        if self.compression == "zstd":
+            self._out.flush(zstandard.FLUSH_BLOCK)
+        elif self.compression == "gzip":
+            self._out.flush()
+        self._raw.flush()
+        if self.journal is not None and self._done:
+            os.fsync(self._raw.fileno()) # The output must be on disk before the journal says so
+            self.journal.append(self._done, self._raw.tell())
+        if self.state is not None and self._done:
+            self.state.commit([username for username, _ in self._done])
+        self._done = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        # Finishes the compressed stream; the underlying stream is left open
+        self.flush()
+        if self.compression is not None:
+            self._out.close()
+        self._raw.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compression_for(filename):
+    # Output compression implied by a file name's extension
+    if filename.endswith(".gz"):
+        return "gzip"
+    if filename.endswith(".zst"):
+        return "zstd"
+    return None
+
+def _write_result(writer, username, data, error, only_changed=False):
+    # Returns 1 for a failed profile so callers can count failures
+    if error is not None:
+        print(f"Error: Failed to scrape {username}: {error}", file=sys.stderr)
+        writer.write_error(username, error)
+        return 1
+    if only_changed and data.get("change") == "unchanged":
+        writer.skip(username)
+    else:
+        writer.write(data, username)
+    return 0
+
+def run_batch(usernames, writer, workers=8, pipeline=False, only_changed=False, **kwargs):
+    # Writes each profile to the JSONLinesWriter as soon as it is parsed, and
+    # an error record for each failed username. Returns the number of failures.
+    # pipeline=True uses pipeline_scrape_many (kwargs may include parse_workers).
+    # only_changed=True (with a StateStore as state) leaves out unchanged profiles.
+    if pipeline:
+        results = pipeline_scrape_many(usernames, fetch_workers=workers, **kwargs)
+    else:
+        results = scrape_many(usernames, workers=workers, **kwargs)
+    failures = 0
+    for username, data, error in results:
+        failures += _write_result(writer, username, data, error, only_changed)
+    return failures
+
+async def run_async_batch(usernames, writer, concurrency=DEFAULT_CONCURRENCY, only_changed=False, **kwargs):
+    # Same as run_batch, using async_scrape_many
+    failures = 0
+    async for username, data, error in async_scrape_many(usernames, concurrency=concurrency, **kwargs):
+        failures += _write_result(writer, username, data, error, only_changed)
+    return failures
+
+class ProfileService:
+    # Profile lookups for `app.py serve`: parsed profiles are kept in memory
+    # for ttl seconds (at most max_entries, least recently used dropped
+    # first), and concurrent lookups of the same username share a single
+    # upstream fetch. kwargs are passed on to scrape (session, cache,
+    # limiter, retry, ...), so connections stay warm between requests.
+
+    def __init__(self, ttl=DEFAULT_MEMORY_TTL, max_entries=DEFAULT_MEMORY_ENTRIES, stats=None, **kwargs):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = stats if stats is not None else Stats()
+        self.scrape_kwargs = kwargs
+        self._profiles = OrderedDict() # lowercased username -> (expires, data)
+        self._in_flight = {} # lowercased username -> Future
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        key = username.lower() # linktr.ee usernames are case-insensitive
+        with self._lock:
+            entry = self._profiles.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._profiles.move_to_end(key)
+                self.stats.incr("memory_hits")
+                return entry[1]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            self.stats.incr("coalesced")
+            return future.result() # Raises the leader's error too
+        try:
+            data = scrape(username, stats=self.stats, **self.scrape_kwargs)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            self._profiles[key] = (time.monotonic() + self.ttl, data)
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+        future.set_result(data)
+        return data
+
+def http_status_for(error):
+    if isinstance(error, ProfileNotFound):
+        return 404
+    if isinstance(error, RateLimited):
+        return 429
+    if isinstance(error, LinktreeError):
+        return 502 # linktr.ee failed us, or its page changed
+    return 500
+
+def make_server(address, service, workers=8):
+    # The HTTP server behind `app.py serve`, answering from service (a
+    # ProfileService). http.server (and the http.client and email modules it
+    # imports) is only needed here, so it is imported on first use.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ProfileRequestHandler(BaseHTTPRequestHandler):
+        # GET /profile/<username>  -> the profile, or an error record
+        # POST /profiles           -> body ["user", ...] or {"usernames": [...]};
+        #                             answers {"results": [profile or error record, ...]}
+        # GET /health              -> {"status": "ok"}
+        # GET /metrics             -> counters and stage timings for Prometheus
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/health":
+                return self._send_json(200, {"status": "ok"})
+            if path == "/metrics":
+                return self._send(200, self.server.service.stats.prometheus().encode("utf-8"),
+                                  "text/plain; version=0.0.4")
+            if not path.startswith("/profile/"):
+                return self._send_json(404, {"status": "error", "error": "Not found"})
+            username = unquote(path[len("/profile/"):])
+            if not username or "/" in username:
+                return self._send_json(400, {"status": "error", "error": "Invalid username"})
+            try:
+                data = self.server.service.get(username)
+            except Exception as e:
+                headers = {}
+                if getattr(e, "retry_after", None) is not None:
+                    headers["Retry-After"] = str(int(e.retry_after + 0.5))
+                return self._send_json(http_status_for(e), error_record(username, e), headers)
+            self._send_json(200, data)
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/profiles":
+                return self._send_json(404, {"status": "error", "error": "Not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            except ValueError:
+                return self._send_json(400, {"status": "error", "error": "Body is not valid JSON"})
+            usernames = body.get("usernames") if isinstance(body, dict) else body
+            if not isinstance(usernames, list) or not all(isinstance(u, str) and u for u in usernames):
+                return self._send_json(400, {"status": "error", "error": "Expected a list of usernames"})
+            if len(usernames) > MAX_BATCH_USERNAMES:
+                return self._send_json(413, {"status": "error", "error": f"At most {MAX_BATCH_USERNAMES} usernames per request"})
+            results = list(self.server.executor.map(self._lookup, usernames))
+            self._send_json(200, {"results": results})
+
+        def _lookup(self, username):
+            try:
+                return self.server.service.get(username)
+            except Exception as e:
+                return error_record(username, e)
+
+        def _send_json(self, status, data, headers=None):
+            with self.server.service.stats.timer("serialize"):
+                body = json_dumps(data)
+            self._send(status, body, "application/json", headers)
+
+        def _send(self, status, body, content_type, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep stderr for errors
+
+    class ProfileServer(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+        def __init__(self):
+            super().__init__(address, ProfileRequestHandler)
+            self.service = service
+            self.executor = ThreadPoolExecutor(max_workers=workers) # For POST /profiles
+
+        def server_close(self):
+            super().server_close()
+            self.executor.shutdown(wait=False)
+
+    return ProfileServer()
+
+def serve_main(argv):
     import argparse
     parser = argparse.ArgumentParser(
-            description="A Tool to Scrape Linktr.ee Profiles (Default Output Format: JSON)"
+            prog="app.py serve",
+            description="Serve Linktr.ee profiles over HTTP: GET /profile/<username> and POST /profiles"
             )
     parser.add_argument(
-                "--username",
-                help="Username of the Linktr.ee Profile"
+                "--host",
+                help="Address to listen on (Default: 127.0.0.1)",
+                default="127.0.0.1"
+            )
+    parser.add_argument(
+                "--port",
+                help=f"Port to listen on (Default: {DEFAULT_PORT})",
+                type=int,
+                default=DEFAULT_PORT
+            )
+    parser.add_argument(
+                "--workers",
+                help="Number of usernames of one POST /profiles request fetched concurrently (Default: 8)",
+                type=int,
+                default=8
+            )
+    parser.add_argument(
+                "--memory-ttl",
+                help=f"Seconds a parsed profile is answered from memory (Default: {DEFAULT_MEMORY_TTL})",
+                type=float,
+                default=DEFAULT_MEMORY_TTL
+            )
+    parser.add_argument(
+                "--memory-entries",
+                help=f"Maximum number of profiles kept in memory (Default: {DEFAULT_MEMORY_ENTRIES})",
+                type=int,
+                default=DEFAULT_MEMORY_ENTRIES
+            )
+    _add_fetch_arguments(parser, argparse)
+    args = parser.parse_args(argv)
+    _set_base_url(args)
+    _set_json_options(args)
+
+    headers = _load_headers(args)
+    pool_size = max(args.pool_size, args.workers)
+    stats = Stats()
+    service = ProfileService(
+        ttl=args.memory_ttl,
+        max_entries=args.memory_entries,
+        stats=stats,
+        identities=_make_identities(args, headers, pool_size, stats),
+        session=make_session(headers, pool_size=pool_size),
+        timeout=(args.connect_timeout, args.read_timeout),
+        stream=args.stream,
+        cache=_make_cache(args),
+        limiter=RateLimiter(rate=args.rate, max_concurrency=pool_size),
+        retry=RetryPolicy(retries=args.retries),
+        timing=args.timing,
+        fields=_compile_fields_arg(args),
+    )
+    server = make_server((args.host, args.port), service, workers=args.workers)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def _add_fetch_arguments(parser, argparse):
+    # Options shared by the scraping modes and `app.py serve`
+    parser.add_argument(
+                "--stream",
+                help="Stop downloading each page as soon as its profile data has been received",
+                action="store_true"
+            )
+    parser.add_argument(
+                "--cache-dir",
+                help="Cache profile data in this directory and revalidate it with conditional requests"
+            )
+    parser.add_argument(
+                "--cache-ttl",
+                help=f"Seconds a cached profile is used without asking linktr.ee (Default: {DEFAULT_CACHE_TTL})",
+                type=float,
+                default=DEFAULT_CACHE_TTL
+            )
+    parser.add_argument(
+                "--cache-max-size",
+                help=f"Maximum cache size in MB, least recently used profiles are evicted first (Default: {DEFAULT_CACHE_MAX_SIZE // (1024 * 1024)})",
+                type=float,
+                default=DEFAULT_CACHE_MAX_SIZE / (1024 * 1024)
+            )
+    parser.add_argument(
+                "--no-cache",
+                help="Ignore cached profiles and fetch everything again (fresh responses are still cached)",
+                action="store_true"
+            )
+    parser.add_argument(
+                "--rate",
+                help="Maximum requests per second to linktr.ee, lowered automatically while it rate limits us (Default: no limit)",
+                type=float
+            )
+    parser.add_argument(
+                "--retries",
+                help=f"Times a rate limited, timed out or 5XX request is retried, with exponential backoff (Default: {DEFAULT_RETRIES})",
+                type=int,
+                default=DEFAULT_RETRIES
+            )
+    parser.add_argument(
+                "--base-url",
+                help=f"Scrape from this server instead of linktr.ee, e.g. a local stand-in for testing (Default: {BASE_URL})"
+            )
+    parser.add_argument(
+                "--pool-size",
+                help=f"Maximum number of kept-alive connections to linktr.ee (Default: {DEFAULT_POOL_SIZE}, or --workers if larger)",
+                type=int,
+                default=DEFAULT_POOL_SIZE
+            )
+    parser.add_argument(
+                "--connect-timeout",
+                help=f"Seconds to wait for a connection to linktr.ee (Default: {DEFAULT_TIMEOUT[0]})",
+                type=float,
+                default=DEFAULT_TIMEOUT[0]
+            )
+    parser.add_argument(
+                "--read-timeout",
+                help=f"Seconds to wait for linktr.ee to send data (Default: {DEFAULT_TIMEOUT[1]})",
+                type=float,
+                default=DEFAULT_TIMEOUT[1]
             )
     parser.add_argument(
                 "--headersFile",
@@ -87,15 +1849,32 @@ if __name__ == "__main__":
                 type=argparse.FileType('r')
             )
     parser.add_argument(
-                "--outfile",
-                help="Write to Desired Outfile.json (Default: stdout)",
-                type=argparse.FileType("w")
+                "--identities",
+                help="Spread requests over the header sets and proxies listed in this JSON file, each with its own connections and rate limit (see README)",
+                type=argparse.FileType('r')
+            )
+    parser.add_argument(
+                "--json-backend",
+                help="JSON library used to decode profile data and encode output: orjson or ujson are faster, auto is the fastest installed (Default: json)",
+                choices=["auto", *JSON_BACKENDS],
+                default="json"
+            )
+    parser.add_argument(
+                "--account-only",
+                help="With the json backend, decode only the account part of each page's data instead of all of it (falls back to all of it if the account can't be found)",
+                action="store_true"
+            )
+    parser.add_argument(
+                "--fields",
+                help="Output these fields of each account instead of the default ones, e.g. username,description,links.id,links.title,links.url,socialLinks"
+            )
+    parser.add_argument(
+                "--timing",
+                help="Add a \"timing\" field to every profile with the milliseconds spent fetching, extracting and parsing it",
+                action="store_true"
             )
-    args = parser.parse_args()
-    if args.username is None:
-        print("Error: No username given. Use --username <username>", file=sys.stderr)
-        sys.exit(1) # Consistently exit with 1 on error
 
+def _load_headers(args):
     headers = None
     if args.headersFile:
         try:
@@ -104,87 +1883,275 @@ if __name__ == "__main__":
             print(f"Error: Could not decode JSON from headers file: {args.headersFile.name}", file=sys.stderr)
             sys.exit(1)
         finally:
-            args.headersFile.close()
+            if args.headersFile: # Ensure it's not None
+                 args.headersFile.close()
+    return headers
 
-    html_source = grab_source(args.username, headers=headers)
-    # grab_source now sys.exit(1) on error, so no need to check html_source for None
+def _make_identities(args, headers, pool_size, stats=None):
+    if not args.identities:
+        return None
+    try:
+        with args.identities:
+            return make_identity_pool(json.load(args.identities), headers=headers, rate=args.rate,
+                                      pool_size=pool_size, stats=stats)
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode JSON from identities file: {args.identities.name}", file=sys.stderr)
+        sys.exit(1)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    data = parse_html(html_source)
-    # parse_html now sys.exit(1) on error, so no need to check data for None
+def _make_cache(args):
+    if not args.cache_dir:
+        return None
+    return ResponseCache(args.cache_dir, ttl=args.cache_ttl,
+                         max_size=int(args.cache_max_size * 1024 * 1024), bypass=args.no_cache)
 
-    if args.outfile:
-        try:
-            json.dump(data, args.outfile)
-        except Exception as e: # Catch potential errors during file write
-            print(f"Error writing JSON to outfile: {e}", file=sys.stderr)
-            sys.exit(1) # main function will exit, no need for separate sys.exit here if main handles it
-        finally:
-            if args.outfile: # Ensure it's not None before closing
-                args.outfile.close() # Ensure file is closed
-    else:
-        try:
-            print(json.dumps(data))
-        except Exception as e: # Catch potential errors during print (less likely for JSON)
-            print(f"Error printing JSON to stdout: {e}", file=sys.stderr)
-            sys.exit(1) # main function will exit
+def _set_base_url(args):
+    global BASE_URL
+    if args.base_url:
+        BASE_URL = args.base_url.rstrip("/")
+
+def _compile_fields_arg(args):
+    if not args.fields:
+        return None
+    try:
+        return compile_fields(args.fields)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def _set_json_options(args):
+    global ACCOUNT_ONLY
+    ACCOUNT_ONLY = args.account_only
+    try:
+        set_json_backend(args.json_backend)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
 def main(argv=None):
     import argparse # Keep argparse import local to main if it's only used here
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["serve"]:
+        return serve_main(argv[1:])
     parser = argparse.ArgumentParser(
-            description="A Tool to Scrape Linktr.ee Profiles (Default Output Format: JSON)"
+            description="A Tool to Scrape Linktr.ee Profiles (Default Output Format: JSON). "
+                        "Run `app.py serve --help` for the HTTP API server."
             )
     parser.add_argument(
                 "--username",
                 help="Username of the Linktr.ee Profile"
             )
     parser.add_argument(
-                "--headersFile",
-                help="Provide Headers.json file containing headers that you want to Specify",
+                "--usernames-file",
+                help="Scrape every username listed in this file, one per line ('-' for stdin). Output is one JSON object per line",
                 type=argparse.FileType('r')
             )
+    parser.add_argument(
+                "--workers",
+                help="Number of profiles fetched concurrently with --usernames-file (Default: 8)",
+                type=int,
+                default=8
+            )
+    parser.add_argument(
+                "--compress",
+                help="Compress the --usernames-file output (Default: from the --outfile extension, .gz or .zst)",
+                choices=["gzip", "zstd", "none"]
+            )
+    parser.add_argument(
+                "--flush-every",
+                help=f"Write the --usernames-file output out every N profiles (and at least once a second) (Default: {DEFAULT_FLUSH_EVERY})",
+                type=int,
+                default=DEFAULT_FLUSH_EVERY
+            )
+    parser.add_argument(
+                "--async",
+                help="Use the asyncio engine (needs aiohttp) with --usernames-file instead of worker threads",
+                action="store_true",
+                dest="use_async"
+            )
+    parser.add_argument(
+                "--concurrency",
+                help=f"Number of requests kept in flight with --async (Default: {DEFAULT_CONCURRENCY})",
+                type=int,
+                default=DEFAULT_CONCURRENCY
+            )
+    parser.add_argument(
+                "--pipeline",
+                help="With --usernames-file, parse pages in a pool of processes (using every core) while --workers threads fetch them",
+                action="store_true"
+            )
+    parser.add_argument(
+                "--parse-workers",
+                help="Number of parsing processes with --pipeline (Default: number of cores)",
+                type=int
+            )
+    parser.add_argument(
+                "--state-db",
+                help="Remember scraped profiles in this SQLite file and mark each one as new, changed (with a diff), unchanged or removed since the last run"
+            )
+    parser.add_argument(
+                "--only-changed",
+                help="With --state-db, leave unchanged profiles out of the output",
+                action="store_true"
+            )
+    _add_fetch_arguments(parser, argparse)
+    parser.add_argument(
+                "--stats",
+                help="Print a summary of time spent per stage, bytes, cache hits and retries to stderr when done",
+                action="store_true"
+            )
     parser.add_argument(
                 "--outfile",
-                help="Write to Desired Outfile.json (Default: stdout)",
-                type=argparse.FileType("w")
+                help="Write to Desired Outfile.json (Default: stdout)" # Opened below, see --journal
+            )
+    parser.add_argument(
+                "--journal",
+                help="With --usernames-file and --outfile, record finished usernames in this file; "
+                     "rerunning with the same journal skips them and continues the output where it stopped"
             )
 
-    # If argv is None, argparse uses sys.argv[1:] by default.
-    # For testing, we can pass a list of strings.
+    # For testing, we can pass a list of strings as argv.
     args = parser.parse_args(argv)
+    _set_base_url(args)
+    _set_json_options(args)
 
-    if args.username is None:
-        print("Error: No username given. Use --username <username>", file=sys.stderr)
+    if args.username is None and args.usernames_file is None:
+        print("Error: No username given. Use --username <username> or --usernames-file <file>", file=sys.stderr)
         sys.exit(1)
-
-    headers = None
-    if args.headersFile:
+    if args.pipeline and args.use_async:
+        print("Error: --pipeline and --async can't be used together", file=sys.stderr)
+        sys.exit(1)
+    if args.identities and args.use_async:
+        print("Error: --identities can't be used with --async", file=sys.stderr)
+        sys.exit(1)
+    if args.only_changed and not args.state_db:
+        print("Error: --only-changed needs --state-db", file=sys.stderr)
+        sys.exit(1)
+    if args.journal and (not args.usernames_file or args.outfile in (None, "-")):
+        print("Error: --journal needs --usernames-file and --outfile", file=sys.stderr)
+        sys.exit(1)
+    if args.outfile == "-":
+        args.outfile = sys.stdout
+    elif args.outfile:
+        # Overwritten like with argparse.FileType("w"), except that a
+        # journaled run keeps it to continue where the journal ends
         try:
-            headers = json.load(args.headersFile)
-        except json.JSONDecodeError:
-            print(f"Error: Could not decode JSON from headers file: {args.headersFile.name}", file=sys.stderr)
-            sys.exit(1)
-        finally:
-            if args.headersFile: # Ensure it's not None
-                 args.headersFile.close()
+            args.outfile = open(args.outfile, "a" if args.journal else "w", encoding="utf-8")
+        except OSError as e:
+            parser.error(f"argument --outfile: can't open '{args.outfile}': {e}")
 
-    html_source = grab_source(args.username, headers=headers)
-    data = parse_html(html_source)
+    headers = _load_headers(args)
+
+    # Headers are set once on the session instead of on every request
+    session = make_session(headers, pool_size=max(args.pool_size, args.workers))
+    timeout = (args.connect_timeout, args.read_timeout)
+    cache = _make_cache(args)
+    retry = RetryPolicy(retries=args.retries)
+
+    fields = _compile_fields_arg(args)
+    stats = Stats() if args.stats else None
+    identities = _make_identities(args, headers, max(args.pool_size, args.workers), stats)
+    state = None
+    if args.state_db:
+        # In batch mode the writer commits profiles' state once their output is on disk
+        state = StateStore(args.state_db, commit_every=None) if args.usernames_file else StateStore(args.state_db)
+    try:
+        if args.usernames_file:
+            # One limiter shared by every worker; it starts at full concurrency
+            # and backs off while linktr.ee throttles or fails
+            limiter = RateLimiter(rate=args.rate,
+                                  max_concurrency=args.concurrency if args.use_async else args.workers)
+            outfile = args.outfile or sys.stdout
+            compression = args.compress or (compression_for(args.outfile.name) if args.outfile else None)
+            usernames = read_usernames(args.usernames_file)
+            journal = None
+            if args.journal:
+                if compression not in (None, "none"):
+                    print("Error: --journal needs uncompressed output", file=sys.stderr)
+                    sys.exit(1)
+                journal = CheckpointJournal(args.journal)
+                # Also when nothing is journaled yet (offset 0), so output left
+                # by a run that never got to its first journal entry is dropped
+                journal.resume(args.outfile.buffer)
+                if journal.done:
+                    print(f"Resuming: {len(journal.done)} username(s) already done", file=sys.stderr)
+                    usernames = (username for username in usernames if username not in journal.done)
+            try:
+                writer = JSONLinesWriter(outfile, compression=None if compression == "none" else compression,
+                                         flush_every=args.flush_every, stats=stats, journal=journal,
+                                         state=state)
+            except RuntimeError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+            try:
+                if args.use_async:
+                    failures = asyncio.run(run_async_batch(usernames, writer,
+                                                           concurrency=args.concurrency, headers=headers,
+                                                           timeout=timeout, stream=args.stream, cache=cache,
+                                                           limiter=limiter, retry=retry,
+                                                           stats=stats, timing=args.timing, state=state,
+                                                           fields=fields, only_changed=args.only_changed))
+                else:
+                    if args.pipeline:
+                        # The parse processes get the selection itself and compile it there
+                        engine = {"pipeline": True, "parse_workers": args.parse_workers, "fields": args.fields}
+                    else:
+                        engine = {"fields": fields}
+                    failures = run_batch(usernames, writer,
+                                         workers=args.workers, session=session, timeout=timeout,
+                                         stream=args.stream, cache=cache, limiter=limiter, retry=retry,
+                                         stats=stats, timing=args.timing, state=state, identities=identities,
+                                         only_changed=args.only_changed, **engine)
+            finally:
+                writer.close()
+                if journal is not None:
+                    journal.close()
+                if args.usernames_file is not sys.stdin:
+                    args.usernames_file.close()
+                if args.outfile:
+                    args.outfile.close()
+            if failures:
+                print(f"Error: {failures} profile(s) could not be scraped", file=sys.stderr)
+                sys.exit(1)
+            return
 
-    if args.outfile:
-        try:
-            json.dump(data, args.outfile)
-        except Exception as e:
-            print(f"Error writing JSON to outfile: {e}", file=sys.stderr)
-            sys.exit(1)
-        finally:
-            if args.outfile:
-                args.outfile.close()
-    else:
         try:
-            print(json.dumps(data))
-        except Exception as e:
-            print(f"Error printing JSON to stdout: {e}", file=sys.stderr)
-            sys.exit(1)
+            data = scrape(args.username, stream=args.stream, cache=cache, retry=retry, stats=stats,
+                          timing=args.timing, state=state, fields=fields, session=session, timeout=timeout,
+                          identities=identities)
+        except LinktreeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(e.exit_code)
+        if args.only_changed and data.get("change") == "unchanged":
+            return
+
+        if args.outfile:
+            try:
+                with _timer(stats, "serialize"):
+                    output = json_dumps(data).decode("utf-8")
+                args.outfile.write(output)
+            except Exception as e:
+                print(f"Error writing JSON to outfile: {e}", file=sys.stderr)
+                sys.exit(1)
+            finally:
+                if args.outfile:
+                    args.outfile.close()
+        else:
+            try:
+                with _timer(stats, "serialize"):
+                    output = json_dumps(data).decode("utf-8")
+                print(output)
+            except Exception as e:
+                print(f"Error printing JSON to stdout: {e}", file=sys.stderr)
+                sys.exit(1)
+    finally:
+        if state is not None:
+            state.close()
+        if stats is not None:
+            print(stats.summary(), file=sys.stderr)
 
 if __name__ == "__main__":
     main()
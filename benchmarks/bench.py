@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Benchmark suite: parse time and memory on the fixture pages, CLI startup
+# time, and end-to-end throughput of each scraping mode against a local stand-in
+# server (benchmarks/mock_server.py) with configurable latency. Results are
+# printed as JSON Lines (one object per measurement) and can be compared
+# against an earlier run to catch regressions.
+#
+#   python3 benchmarks/bench.py --output results.jsonl
+#   python3 benchmarks/bench.py --baseline results.jsonl # Exits 1 on a regression
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from unittest.mock import patch
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+import app
+from mock_server import MockLinktreeServer, load_fixtures
+
+MODES = ["parse", "startup", "single", "batch", "stream", "async", "cached", "pipeline"]
+
+# Which number decides whether a result got worse, and in which direction
+METRICS = {"parse": ("fast_seconds", "lower"), "startup": ("seconds", "lower"),
+           "e2e": ("profiles_per_second", "higher")}
+
+# What a fresh interpreter runs in 'startup' mode, reported as its "fixture"
+STARTUP_COMMANDS = {
+    "import": ["-c", "import app"],
+    "help": [os.path.join(REPO_DIR, "app.py"), "--help"],
+}
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def best_of(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+def traced_peak(fn):
+    # Peak memory allocated by Python while fn runs
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_parse(fixtures, repeat):
+    for name, raw in fixtures.items():
+        text = raw.decode("utf-8")
+        result = {
+            "mode": "parse",
+            "fixture": name,
+            "bytes": len(raw),
+            "fast_seconds": best_of(lambda: app.parse_html(raw), repeat),
+            "fast_peak_bytes": traced_peak(lambda: app.parse_html(raw)),
+        }
+        with patch("app.extract_next_data", return_value=None): # Force the BeautifulSoup path
+            result["bs4_seconds"] = best_of(lambda: app.parse_html(text), repeat)
+            result["bs4_peak_bytes"] = traced_peak(lambda: app.parse_html(text))
+        result["speedup"] = round(result["bs4_seconds"] / result["fast_seconds"], 1)
+        # Decoding __NEXT_DATA__ alone, with every installed JSON backend and
+        # with only the account subtree decoded
+        payload = app.extract_next_data(raw)
+        for backend in [name for name, functions in app.JSON_BACKENDS.items() if functions is not None]:
+            app.set_json_backend(backend)
+            result[f"{backend}_decode_seconds"] = best_of(lambda: app.parse_next_data(payload, account_only=False), repeat)
+        app.set_json_backend()
+        result["account_only_seconds"] = best_of(lambda: app.parse_next_data(payload, account_only=True), repeat)
+        result["account_only_peak_bytes"] = traced_peak(lambda: app.parse_next_data(payload, account_only=True))
+        yield result
+
+def bench_startup(repeat):
+    # Wall time of a new process, which is mostly imports; the heavy
+    # dependencies should only be loaded by the code paths that use them
+    for name, command in STARTUP_COMMANDS.items():
+        run = lambda: subprocess.run([sys.executable] + command, check=True, cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+        yield {"mode": "startup", "fixture": name, "seconds": best_of(run, repeat)}
+
+def run_single(usernames, server_url):
+    # One CLI process per profile, the way the tool was used before batch mode
+    for username in usernames:
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, "app.py"), "--username", username,
+                        "--base-url", server_url], check=True, stdout=subprocess.DEVNULL)
+    return 0
+
+def run_batch(usernames, args, **kwargs):
+    session = app.make_session(pool_size=args.workers)
+    with open(os.devnull, "wb") as devnull, app.JSONLinesWriter(devnull) as writer:
+        return app.run_batch(usernames, writer, workers=args.workers, session=session, **kwargs)
+
+def run_async(usernames, args):
+    with open(os.devnull, "wb") as devnull, app.JSONLinesWriter(devnull) as writer:
+        return asyncio.run(app.run_async_batch(usernames, writer, concurrency=args.concurrency))
+
+def bench_e2e(mode, fixture, args, server):
+    profiles = min(args.profiles, args.single_profiles) if mode == "single" else args.profiles
+    usernames = [f"{fixture}-{i}" for i in range(profiles)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if mode == "single":
+            run = lambda: run_single(usernames, server.url)
+        elif mode == "batch":
+            run = lambda: run_batch(usernames, args)
+        elif mode == "stream":
+            run = lambda: run_batch(usernames, args, stream=True)
+        elif mode == "async":
+            run = lambda: run_async(usernames, args)
+        elif mode == "pipeline":
+            run = lambda: run_batch(usernames, args, pipeline=True, parse_workers=args.parse_workers)
+        elif mode == "cached":
+            cache = app.ResponseCache(cache_dir, ttl=3600)
+            run_batch(usernames, args, cache=cache) # Warm the cache, not measured
+            run = lambda: run_batch(usernames, args, cache=cache)
+        requests_before = server.request_count
+        start = time.perf_counter()
+        failures = run()
+        seconds = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "fixture": fixture,
+        "profiles": profiles,
+        "failures": failures,
+        "latency": args.latency,
+        "seconds": seconds,
+        "profiles_per_second": profiles / seconds,
+        "upstream_requests": server.request_count - requests_before,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+def regressions(results, baseline, tolerance):
+    # Yields a message for each result that is worse than its baseline by
+    # more than tolerance (a fraction)
+    previous = {(r["mode"], r["fixture"]): r for r in baseline}
+    for result in results:
+        before = previous.get((result["mode"], result["fixture"]))
+        if before is None:
+            continue
+        metric, better = METRICS.get(result["mode"], METRICS["e2e"])
+        old, new = before[metric], result[metric]
+        change = (new - old) / old if better == "lower" else (old - new) / old
+        if change > tolerance:
+            yield f"{result['mode']}/{result['fixture']}: {metric} {old:.6g} -> {new:.6g} ({change:+.0%} worse)"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark linktree2JSON")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma separated, from: {','.join(MODES)}")
+    parser.add_argument("--fixtures", help="Comma separated fixture names (Default: all)")
+    parser.add_argument("--profiles", type=int, default=200, help="Profiles scraped per end-to-end run")
+    parser.add_argument("--single-profiles", type=int, default=20, help="Profiles scraped in 'single' mode (one process each)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stand-in server waits per request")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--parse-workers", type=int, help="Processes in 'pipeline' mode (Default: number of cores)")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per parse measurement (best is reported)")
+    parser.add_argument("--output", type=argparse.FileType("w"), help="Also write the results to this file")
+    parser.add_argument("--baseline", type=argparse.FileType("r"), help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against --baseline (Default: 0.2)")
+    args = parser.parse_args()
+
+    modes = args.modes.split(",")
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+    fixtures = load_fixtures()
+    if args.fixtures:
+        fixtures = {name: fixtures[name] for name in args.fixtures.split(",")}
+
+    results = []
+    def report(result):
+        results.append(result)
+        line = json.dumps(result)
+        print(line, flush=True)
+        if args.output:
+            args.output.write(line + "\n")
+
+    if "parse" in modes:
+        for result in bench_parse(fixtures, args.repeat):
+            report(result)
+    if "startup" in modes:
+        for result in bench_startup(max(1, args.repeat // 4)):
+            report(result)
+    e2e_modes = [mode for mode in modes if mode not in ("parse", "startup")]
+    if e2e_modes:
+        with MockLinktreeServer(fixtures, latency=args.latency) as server, \
+                patch("app.BASE_URL", server.url):
+            for fixture in fixtures:
+                for mode in e2e_modes:
+                    report(bench_e2e(mode, fixture, args, server))
+
+    if args.baseline:
+        baseline = [json.loads(line) for line in args.baseline if line.strip()]
+        problems = list(regressions(results, baseline, args.tolerance))
+        for problem in problems:
+            print(f"Regression: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
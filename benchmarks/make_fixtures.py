@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Generates the synthetic Linktree profile pages in benchmarks/fixtures/.
+# The pages mimic the shape of a real linktr.ee page (a large Next.js head,
+# rendered link buttons and a __NEXT_DATA__ payload with theme/analytics
+# data around the account), so parse benchmarks see realistic sizes without
+# shipping anyone's real profile. Output is deterministic; rerun after
+# changing it and commit the results.
+import json
+import os
+import random
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# name: (number of links, number of rendered filler blocks)
+SIZES = {
+    "small": (5, 20),
+    "medium": (40, 200),
+    "large": (250, 1500),
+}
+
+def make_account(username, n_links, rng):
+    links = []
+    for i in range(n_links):
+        links.append({
+            "id": 1000000 + i,
+            "type": rng.choice(["CLASSIC", "YOUTUBE_VIDEO", "MUSIC", "COMMERCE"]),
+            "title": f"link number {i} for {username}",
+            "url": f"https://example.com/{username}/{i}",
+            "position": i,
+            "locked": None,
+            "thumbnail": f"https://ugc.example.com/thumbnails/{rng.getrandbits(64):016x}.jpg",
+            "modifiers": {"animation": None, "thumbnailUrl": None, "isForwardingLink": False},
+            "context": {"embedOption": "GENERIC", "theme": rng.choice(["dark", "light"])},
+        })
+    return {
+        "id": rng.randint(1, 10 ** 8),
+        "uuid": f"{rng.getrandbits(128):032x}",
+        "username": username,
+        "description": f"Bio of {username}",
+        "profilePictureUrl": f"https://ugc.example.com/{username}.jpg",
+        "pageTitle": username,
+        "links": links,
+        "socialLinks": [
+            {"type": kind, "url": f"https://{kind.lower()}.example.com/{username}", "position": i}
+            for i, kind in enumerate(["INSTAGRAM", "YOUTUBE", "TIKTOK", "TWITTER"])
+        ],
+        "integrations": [],
+        "theme": {"key": "custom", "background": {"color": "#ffffff", "type": "COLOR"}},
+    }
+
+def make_page(username, n_links, n_blocks, seed=0):
+    rng = random.Random(seed)
+    next_data = {
+        "props": {
+            "pageProps": {
+                "account": make_account(username, n_links, rng),
+                "theme": {f"token{i}": f"#{rng.getrandbits(24):06x}" for i in range(300)},
+                "pageMeta": {"title": username, "description": "Linktree. Make your link do more."},
+                "analytics": [{"event": f"event{i}", "payload": "x" * 40} for i in range(n_blocks // 4)],
+            },
+            "__N_SSP": True,
+        },
+        "page": "/[profile]",
+        "query": {"profile": username},
+        "buildId": f"{rng.getrandbits(64):016x}",
+        "isFallback": False,
+    }
+    head = "".join(
+        f'<link rel="preload" href="/_next/static/chunks/{rng.getrandbits(64):016x}.js" as="script"/>'
+        for _ in range(60)
+    )
+    style = "<style>" + "".join(
+        f".c{i}{{color:#{rng.getrandbits(24):06x};margin:{i % 16}px}}" for i in range(n_blocks)
+    ) + "</style>"
+    buttons = "".join(
+        f'<div class="c{i}" data-testid="LinkContainer"><a href="https://example.com/{username}/{i}" '
+        f'target="_blank" rel="noopener"><span class="c{i}">Link {i}</span></a></div>'
+        for i in range(n_blocks)
+    )
+    return (
+        "<!DOCTYPE html><html lang=\"en\"><head><meta charSet=\"utf-8\"/>"
+        f"<title>{username} | Linktree</title>{head}{style}</head>"
+        f"<body><div id=\"__next\">{buttons}</div>"
+        f"<script id=\"__NEXT_DATA__\" type=\"application/json\" crossorigin=\"anonymous\">"
+        f"{json.dumps(next_data, separators=(',', ':'))}</script></body></html>"
+    )
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for name, (n_links, n_blocks) in SIZES.items():
+        path = os.path.join(FIXTURES_DIR, f"{name}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_page(f"{name}profile", n_links, n_blocks))
+        print(f"{path}: {os.path.getsize(path)} bytes")
+
+if __name__ == "__main__":
+    main()
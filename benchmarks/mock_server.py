@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Local stand-in for linktr.ee, used by the benchmarks and by test_app.py.
+# GET /<name> answers with pages[name], and GET /<fixture>-<anything> with
+# pages[<fixture>] (e.g. /medium-42 serves benchmarks/fixtures/medium.html),
+# after sleeping for the configured latency. Responses carry an ETag and
+# answer If-None-Match with 304 like the real site, and unknown paths get a 404.
+#
+#   python3 benchmarks/mock_server.py --port 8000 --latency 0.05
+#   python3 app.py --username medium-1 --base-url http://127.0.0.1:8000
+import argparse
+import os
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_fixtures():
+    fixtures = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+                fixtures[name[:-len(".html")]] = f.read()
+    return fixtures
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # The default backlog of 5 drops connections under --concurrency
+
+class MockLinktreeServer:
+    # Runs in a background thread while used as a context manager. pages maps
+    # names to str or bytes bodies and may be changed while serving.
+
+    def __init__(self, pages=None, host="127.0.0.1", port=0, latency=0.0):
+        self.pages = pages if pages is not None else load_fixtures()
+        self.latency = latency
+        self.requests = [] # (path, headers) of every request received
+        self.failures = {} # name -> [(status, headers), ...] answered before the page
+        self._etags = {} # name -> (body, etag), so large fixtures aren't hashed per request
+        self.httpd = _Server((host, port), self._handler())
+        self.url = "http://%s:%d" % self.httpd.server_address[:2]
+
+    @property
+    def request_count(self):
+        return len(self.requests)
+
+    def _page(self, path):
+        # The body and ETag served at path, or (None, None)
+        name = path.lstrip("/")
+        if name not in self.pages:
+            name = name.split("-", 1)[0]
+        body = self.pages.get(name)
+        if body is None:
+            return None, None
+        if isinstance(body, str):
+            body = body.encode()
+        cached = self._etags.get(name)
+        if cached is None or cached[0] != body:
+            cached = self._etags[name] = (body, '"%x"' % zlib.crc32(body))
+        return cached
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like linktr.ee
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                if server.latency:
+                    time.sleep(server.latency)
+                failures = server.failures.get(self.path.lstrip("/"))
+                if failures:
+                    status, headers = failures.pop(0)
+                    self._reply(status, b"", headers)
+                    return
+                body, etag = server._page(self.path)
+                if body is None:
+                    self._reply(404, b"Not Found")
+                elif self.headers.get("If-None-Match") == etag:
+                    self._reply(304, b"", {"ETag": etag})
+                else:
+                    self._reply(200, body, {"ETag": etag})
+
+            def _reply(self, status, body, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixtures like linktr.ee would")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before every response")
+    args = parser.parse_args()
+    server = MockLinktreeServer(host=args.host, port=args.port, latency=args.latency)
+    print(f"Serving {', '.join(server.pages)} on {server.url} (latency {args.latency}s)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
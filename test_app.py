@@ -1,8 +1,24 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import sys
+import io
+import os
 import json
+import tempfile
+import pickle
+import http.client
+import subprocess
+import email.utils
+import gzip
+import asyncio
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
 import app # Import the app module itself for app.main()
+from benchmarks.mock_server import MockLinktreeServer
 
 # Assuming app.py is in the same directory or accessible via PYTHONPATH
 from app import grab_source, parse_html
@@ -10,8 +26,9 @@ import requests # For requests.exceptions.HTTPError
 
 class TestGrabSource(unittest.TestCase):
 
-    @patch('app.requests.get')
-    def test_grab_source_success(self, mock_get):
+    @patch('app.get_session')
+    def test_grab_source_success(self, mock_get_session):
+        mock_get = mock_get_session.return_value.get
         # Configure the mock response for a successful request
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -21,43 +38,168 @@ class TestGrabSource(unittest.TestCase):
 
         source = grab_source("testuser")
         self.assertEqual(source, "<html><body>Success</body></html>")
-        mock_get.assert_called_once_with("https://linktr.ee/testuser") # headers=None is not passed if headers is None
+        mock_get.assert_called_once_with("https://linktr.ee/testuser", headers=None, timeout=app.DEFAULT_TIMEOUT)
         mock_response.raise_for_status.assert_called_once()
 
-    @patch('app.requests.get')
-    @patch('app.sys.exit')
-    def test_grab_source_http_error_404(self, mock_app_sys_exit, mock_requests_get): # Order matches decorators
-        # Configure the mock response for a 404 error
+    def _http_error_response(self, status, headers=None):
         mock_response = MagicMock()
-        mock_response.status_code = 404
-        http_error = requests.exceptions.HTTPError("404 Client Error: Not Found for url")
+        mock_response.status_code = status
+        mock_response.headers = headers or {}
+        http_error = requests.exceptions.HTTPError(f"{status} Client Error", response=mock_response)
         mock_response.raise_for_status = MagicMock(side_effect=http_error)
-        mock_requests_get.return_value = mock_response
+        return mock_response
 
-        mock_app_sys_exit.side_effect = SystemExit(1) # Ensure exit code is 1
+    @patch('app.get_session')
+    def test_grab_source_http_error_404(self, mock_get_session):
+        mock_requests_get = mock_get_session.return_value.get
+        # Configure the mock response for a 404 error
+        mock_response = self._http_error_response(404)
+        mock_requests_get.return_value = mock_response
 
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.ProfileNotFound) as cm:
             grab_source("nonexistentuser")
 
-        self.assertEqual(cm.exception.code, 1) # Check exit code
-        mock_requests_get.assert_called_once_with("https://linktr.ee/nonexistentuser")
+        self.assertEqual(cm.exception.username, "nonexistentuser")
+        self.assertEqual(cm.exception.status, 404)
+        mock_requests_get.assert_called_once_with("https://linktr.ee/nonexistentuser", headers=None, timeout=app.DEFAULT_TIMEOUT)
         mock_response.raise_for_status.assert_called_once()
-        mock_app_sys_exit.assert_called_once_with(1)
 
-    @patch('app.requests.get')
-    @patch('app.sys.exit')
-    def test_grab_source_other_request_exception(self, mock_app_sys_exit, mock_requests_get): # Order matches
+    @patch('app.get_session')
+    def test_grab_source_rate_limited(self, mock_get_session):
+        mock_get_session.return_value.get.return_value = self._http_error_response(429, {"Retry-After": "30"})
+        with self.assertRaises(app.RateLimited) as cm:
+            grab_source("busyuser")
+        self.assertEqual(cm.exception.status, 429)
+        self.assertEqual(cm.exception.retry_after, 30.0)
+        self.assertIsInstance(cm.exception, app.FetchError)
+
+    @patch('app.get_session')
+    def test_grab_source_server_error(self, mock_get_session):
+        mock_get_session.return_value.get.return_value = self._http_error_response(503)
+        with self.assertRaises(app.FetchError) as cm:
+            grab_source("anyuser")
+        self.assertEqual(type(cm.exception), app.FetchError)
+        self.assertEqual(cm.exception.status, 503)
+
+    @patch('app.get_session')
+    def test_grab_source_other_request_exception(self, mock_get_session):
+        mock_requests_get = mock_get_session.return_value.get
         request_exception = requests.exceptions.RequestException("Some other network error")
         mock_requests_get.side_effect = request_exception
 
-        mock_app_sys_exit.side_effect = SystemExit(1) # Ensure exit code is 1
-
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.FetchError) as cm:
             grab_source("anyuser")
 
-        self.assertEqual(cm.exception.code, 1)
-        mock_requests_get.assert_called_once_with("https://linktr.ee/anyuser")
-        mock_app_sys_exit.assert_called_once_with(1)
+        self.assertEqual(cm.exception.username, "anyuser")
+        self.assertIsNone(cm.exception.status)
+        mock_requests_get.assert_called_once_with("https://linktr.ee/anyuser", headers=None, timeout=app.DEFAULT_TIMEOUT)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(app._parse_retry_after("12"), 12.0)
+        self.assertIsNone(app._parse_retry_after(None))
+        self.assertIsNone(app._parse_retry_after("soon"))
+        future = email.utils.formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(app._parse_retry_after(future), 60, delta=2)
+
+    def test_errors_survive_pickling(self):
+        # Errors cross process boundaries when parse_html runs in a ProcessPoolExecutor
+        error = pickle.loads(pickle.dumps(app.RateLimited("slow down", username="u", retry_after=5)))
+        self.assertEqual((str(error), error.username, error.status, error.retry_after), ("slow down", "u", 429, 5))
+
+    def test_grab_source_uses_given_session_and_timeout(self):
+        session = MagicMock()
+        session.get.return_value.text = "<html></html>"
+        source = grab_source("testuser", session=session, timeout=(1, 2))
+        self.assertEqual(source, "<html></html>")
+        session.get.assert_called_once_with("https://linktr.ee/testuser", headers=None, timeout=(1, 2))
+
+    def test_get_session_is_shared(self):
+        with patch('app._session', None):
+            self.assertIs(app.get_session(), app.get_session())
+
+    def test_make_session_applies_headers_and_pool_size(self):
+        session = app.make_session({"X-Test-Header": "true"}, pool_size=4)
+        self.assertEqual(session.headers["X-Test-Header"], "true")
+        adapter = session.get_adapter("https://linktr.ee/someone")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertTrue(adapter._pool_block)
+        session.close()
+
+
+
+class TestStreaming(unittest.TestCase):
+
+    def _page(self):
+        payload = json.dumps({"props": {"pageProps": {"account": {"username": "streamer"}}}}).encode()
+        html = (b'<html><head><script src="x.js"></script></head><body>' + b'<div>filler</div>' * 500
+                + b'<script id="__NEXT_DATA__" type="application/json" crossorigin="anonymous">'
+                + payload + b'</script></body></html>')
+        return html, payload
+
+    def test_extractor_handles_every_chunk_boundary(self):
+        html, payload = self._page()
+        for size in (1, 2, 3, 7, 64, 1000, len(html)):
+            extractor = app.NextDataExtractor()
+            result = None
+            for i in range(0, len(html), size):
+                result = extractor.feed(html[i:i + size])
+                if result is not None:
+                    break
+            self.assertEqual(result, payload, f"chunk size {size}")
+
+    def test_extractor_does_not_keep_page_prefix(self):
+        html, _ = self._page()
+        extractor = app.NextDataExtractor()
+        for i in range(0, len(html) // 2, 100):
+            self.assertIsNone(extractor.feed(html[i:i + 100]))
+            self.assertLess(len(extractor._buf), 200)
+
+    def test_extractor_scans_payload_once(self):
+        # Next.js escapes "<" in the payload, so no chunk should make the
+        # extractor search the part of the payload it has already seen
+        payload = json.dumps({"props": {"pageProps": {"account": {"username": "x", "bio": "y" * 100000}}}}).encode()
+        html = b'<html><body><script id="__NEXT_DATA__">' + payload + b'</script></body></html>'
+        start_re, end_re = app._NEXT_DATA_PATTERNS[bytes]
+        scanned = []
+        class RecordingPattern:
+            def search(self, buf, pos=0):
+                scanned.append(len(buf) - pos)
+                return end_re.search(buf, pos)
+        with patch.dict(app._NEXT_DATA_PATTERNS, {bytes: (start_re, RecordingPattern())}):
+            extractor = app.NextDataExtractor()
+            for i in range(0, len(html), 1024):
+                result = extractor.feed(html[i:i + 1024])
+        self.assertEqual(result, payload)
+        self.assertLess(sum(scanned), 2 * len(html))
+
+    def test_grab_next_data_stops_reading_after_payload(self):
+        html, payload = self._page()
+        chunks = [html[i:i + 256] for i in range(0, len(html), 256)] + [b"never read"] * 1000
+        consumed = []
+        def iter_content(chunk_size):
+            for chunk in chunks:
+                consumed.append(chunk)
+                yield chunk
+        session = MagicMock()
+        response = session.get.return_value.__enter__.return_value
+        response.iter_content.side_effect = iter_content
+
+        self.assertEqual(app.grab_next_data("streamer", session=session), payload)
+        session.get.assert_called_once_with("https://linktr.ee/streamer", headers=None,
+                                            timeout=app.DEFAULT_TIMEOUT, stream=True)
+        session.get.return_value.__exit__.assert_called_once() # Response closed
+        self.assertNotIn(b"never read", consumed)
+
+    def test_grab_next_data_missing_script_raises(self):
+        session = MagicMock()
+        session.get.return_value.__enter__.return_value.iter_content.return_value = [b"<html></html>"]
+        with self.assertRaises(app.StructureChanged):
+            app.grab_next_data("nobody", session=session)
+
+    def test_scrape_stream(self):
+        with patch('app.grab_next_data', return_value=self._page()[1]) as mock_grab:
+            self.assertEqual(app.scrape("streamer", stream=True)["username"], "streamer")
+        mock_grab.assert_called_once_with("streamer")
 
 
 class TestParseHtml(unittest.TestCase):
@@ -109,53 +251,59 @@ class TestParseHtml(unittest.TestCase):
         parsed_info = parse_html(html_source)
         self.assertEqual(parsed_info, expected_info)
 
-    @patch('app.sys.exit')
-    def test_parse_html_no_next_data_script(self, mock_app_sys_exit):
+    def test_parse_html_no_next_data_script(self):
         html_source = "<html><body><p>No script tag</p></body></html>"
-        mock_app_sys_exit.side_effect = SystemExit(1)
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.StructureChanged):
             parse_html(html_source)
-        self.assertEqual(cm.exception.code, 1)
-        mock_app_sys_exit.assert_called_once_with(1)
 
-    @patch('app.sys.exit')
-    def test_parse_html_json_decode_error(self, mock_app_sys_exit):
+    def test_parse_html_json_decode_error(self):
         html_source = self._create_html_with_next_data("This is not valid JSON")
-        mock_app_sys_exit.side_effect = SystemExit(1)
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.DecodeError):
             parse_html(html_source)
-        self.assertEqual(cm.exception.code, 1)
-        mock_app_sys_exit.assert_called_once_with(1)
 
-    @patch('app.sys.exit')
-    def test_parse_html_key_error_props(self, mock_app_sys_exit):
+    def test_parse_html_key_error_props(self):
         next_data = {"wrong_props_key": {}}
         html_source = self._create_html_with_next_data(next_data)
-        mock_app_sys_exit.side_effect = SystemExit(1)
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.StructureChanged):
             parse_html(html_source)
-        self.assertEqual(cm.exception.code, 1)
-        mock_app_sys_exit.assert_called_once_with(1)
 
-    @patch('app.sys.exit')
-    def test_parse_html_key_error_page_props(self, mock_app_sys_exit):
+    def test_parse_html_key_error_page_props(self):
         next_data = {"props": {"wrong_page_props_key": {}}}
         html_source = self._create_html_with_next_data(next_data)
-        mock_app_sys_exit.side_effect = SystemExit(1)
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.StructureChanged):
             parse_html(html_source)
-        self.assertEqual(cm.exception.code, 1)
-        mock_app_sys_exit.assert_called_once_with(1)
 
-    @patch('app.sys.exit')
-    def test_parse_html_key_error_account(self, mock_app_sys_exit):
+    def test_parse_html_key_error_account(self):
         next_data = {"props": {"pageProps": {"wrong_account_key": {}}}}
         html_source = self._create_html_with_next_data(next_data)
-        mock_app_sys_exit.side_effect = SystemExit(1)
-        with self.assertRaises(SystemExit) as cm:
+        with self.assertRaises(app.StructureChanged):
             parse_html(html_source)
-        self.assertEqual(cm.exception.code, 1)
-        mock_app_sys_exit.assert_called_once_with(1)
+
+    def test_parse_html_account_not_an_object(self):
+        for account in (None, [], "user"):
+            html_source = self._create_html_with_next_data({"props": {"pageProps": {"account": account}}})
+            with self.subTest(account=account), self.assertRaises(app.StructureChanged):
+                parse_html(html_source)
+
+    def test_extract_next_data_str_and_bytes(self):
+        html_source = '<html><script src="a.js"></script><script id="__NEXT_DATA__" type="application/json">{"a": 1}</script ></html>'
+        self.assertEqual(app.extract_next_data(html_source), '{"a": 1}')
+        self.assertEqual(app.extract_next_data(html_source.encode()), b'{"a": 1}')
+        self.assertIsNone(app.extract_next_data('<script id="__NEXT_DATA__x">{}</script>'))
+        self.assertIsNone(app.extract_next_data('<script id="__NEXT_DATA__">{"unterminated": 1}'))
+
+    @patch('app.bs4.BeautifulSoup')
+    def test_parse_html_fast_path_skips_beautifulsoup(self, mock_soup):
+        html_source = self._create_html_with_next_data({"props": {"pageProps": {"account": {"username": "fast"}}}})
+        self.assertEqual(parse_html(html_source)["username"], "fast")
+        self.assertEqual(parse_html(html_source.encode())["username"], "fast")
+        mock_soup.assert_not_called()
+
+    @patch('app.extract_next_data', return_value=None)
+    def test_parse_html_falls_back_to_beautifulsoup(self, mock_extract):
+        html_source = self._create_html_with_next_data({"props": {"pageProps": {"account": {"username": "slow"}}}})
+        self.assertEqual(parse_html(html_source)["username"], "slow")
+        mock_extract.assert_called_once_with(html_source)
 
     @patch('app.sys.stderr', new_callable=MagicMock) # To check warnings
     def test_parse_html_malformed_links(self, mock_stderr):
@@ -211,8 +359,150 @@ class TestParseHtml(unittest.TestCase):
 # focusing on how it calls other functions based on arguments.
 # No longer need to mock ArgumentParser as we call app.main directly with argv list.
 
+class TestFields(unittest.TestCase):
+
+    def setUp(self):
+        self.account = {
+            "username": "alice", "description": "Bio", "uuid": "u-1",
+            "links": [{"id": 1, "type": "CLASSIC", "title": "one", "url": "http://one", "modifiers": {"a": 1}},
+                      {"id": 2, "type": "MUSIC", "title": "two", "url": "http://two"}],
+            "socialLinks": [{"type": "INSTAGRAM", "url": "http://ig"}],
+            "theme": {"background": {"color": "#fff", "type": "COLOR"}},
+        }
+        self.payload = json.dumps({"props": {"pageProps": {"account": self.account}}})
+
+    def test_compile_fields(self):
+        extract = app.compile_fields("links.id, links.type,socialLinks,theme.background.color,missing")
+        self.assertEqual(extract(self.account), {
+            "username": "alice",
+            "links": [{"id": 1, "type": "CLASSIC"}, {"id": 2, "type": "MUSIC"}],
+            "socialLinks": [{"type": "INSTAGRAM", "url": "http://ig"}],
+            "theme": {"background": {"color": "#fff"}},
+            "missing": None,
+        })
+        self.assertIs(app.compile_fields(["links.id", "links.type", "socialLinks", "theme.background.color",
+                                          "missing"]), extract) # Compiled once
+        self.assertEqual(app.compile_fields("links.modifiers.a")({"username": "bob", "links": None}),
+                         {"username": "bob", "links": None})
+        with self.assertRaises(ValueError):
+            app.compile_fields("links..id")
+
+    def test_parse_with_fields(self):
+        self.assertEqual(app.parse_next_data(self.payload, fields="uuid,links.url"),
+                         {"username": "alice", "uuid": "u-1", "links": [{"url": "http://one"}, {"url": "http://two"}]})
+        html = _profile_html("bob", [("site", "http://site")])
+        self.assertEqual(app.parse_html(html, fields=app.compile_fields("links.title")),
+                         {"username": "bob", "links": [{"title": "site"}]})
+        # The default output is unchanged
+        self.assertEqual(app.parse_next_data(self.payload)["links"], [{"One": "http://one"}, {"Two": "http://two"}])
+
+    @patch('builtins.print')
+    @patch('app.grab_source')
+    def test_main_fields(self, mock_grab, mock_print):
+        mock_grab.return_value = f'<script id="__NEXT_DATA__">{self.payload}</script>'
+        app.main(['--username', 'alice', '--fields', 'links.id,socialLinks.type', '--timing'])
+        data = json.loads(mock_print.call_args[0][0])
+        data.pop("timing")
+        self.assertEqual(data, {"username": "alice", "links": [{"id": 1}, {"id": 2}],
+                                "socialLinks": [{"type": "INSTAGRAM"}]})
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_invalid_fields(self, mock_stderr):
+        with self.assertRaises(SystemExit):
+            app.main(['--username', 'alice', '--fields', 'links.'])
+
+    def test_pipeline_fields(self):
+        with MockLinktreeServer({"bob": _profile_html("bob", [("site", "http://site")])}) as server, \
+                patch('app.BASE_URL', server.url):
+            results = list(app.pipeline_scrape_many(["bob"], parse_workers=1, fields=["links.url"]))
+        self.assertEqual(results, [("bob", {"username": "bob", "links": [{"url": "http://site"}]}, None)])
+
+
+class TestJSONBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(app.set_json_backend, app.json_backend)
+        self.account = {"username": "alice", "description": "Bio", "profilePictureUrl": None,
+                        "links": [{"title": "one", "url": "http://one"}]}
+        self.payload = json.dumps({"props": {"pageProps": {
+            "theme": {"color": "#fff"}, "account": self.account, "analytics": [1, 2, 3]}}})
+
+    def test_backends(self):
+        for name, functions in app.JSON_BACKENDS.items():
+            if functions is None:
+                continue
+            app.set_json_backend(name)
+            self.assertEqual(app.json_backend, name)
+            self.assertEqual(json.loads(app.json_dumps({"é": ["/", 1]})), {"é": ["/", 1]})
+            self.assertEqual(app.parse_next_data(self.payload.encode())["username"], "alice")
+        app.set_json_backend("json")
+        self.assertEqual(app.json_dumps({"n": 1}), b'{"n": 1}')
+
+    def test_unknown_or_missing_backend(self):
+        with self.assertRaises(ValueError):
+            app.set_json_backend("simplejson")
+        with patch.dict(app.JSON_BACKENDS, {"ujson": None}):
+            with self.assertRaises(RuntimeError):
+                app.set_json_backend("ujson")
+
+    @unittest.skipUnless(app.JSON_BACKENDS["orjson"], "orjson is not installed")
+    def test_loads_errors(self):
+        app.set_json_backend("orjson")
+        with self.assertRaises(ValueError):
+            app.json_loads(b"{")
+
+    def test_default_backend_is_exact_stdlib(self):
+        app.set_json_backend()
+        self.assertEqual(app.json_backend, "json")
+        big = 2 ** 70 + 1
+        self.assertEqual(app.json_loads(b'{"n": %d}' % big), {"n": big})
+        self.assertEqual(app.parse_next_data(json.dumps({"props": {"pageProps": {"account": {
+            "username": "alice", "id": big}}}}), fields="id")["id"], big)
+        record = {"username": "é", "links": [{"Site": "http://example.com/"}]}
+        self.assertEqual(app.json_dumps(record), json.dumps(record).encode())
+
+    def test_account_only(self):
+        full = app.parse_next_data(self.payload, account_only=False)
+        with patch('app.json_loads') as mock_loads:
+            self.assertEqual(app.parse_next_data(self.payload.encode(), account_only=True), full)
+            mock_loads.assert_not_called()
+        with patch('app.ACCOUNT_ONLY', True), patch('app._decode_account') as mock_decode:
+            mock_decode.return_value = self.account
+            app.parse_next_data(self.payload)
+            mock_decode.assert_called_once_with(self.payload)
+
+    @unittest.skipUnless(app.JSON_BACKENDS["orjson"], "orjson is not installed")
+    def test_account_only_is_skipped_with_faster_backends(self):
+        app.set_json_backend("orjson")
+        with patch('app._decode_account') as mock_decode:
+            self.assertEqual(app.parse_next_data(self.payload, account_only=True)["username"], "alice")
+            mock_decode.assert_not_called()
+
+    def test_account_only_falls_back(self):
+        # Not an account where one was expected: decode everything
+        payload = json.dumps({"props": {"pageProps": {"user": {"account": "not this one"}, "account": self.account}}})
+        self.assertIsNone(app._decode_account(payload))
+        self.assertEqual(app.parse_next_data(payload, account_only=True)["username"], "alice")
+        self.assertIsNone(app._decode_account(b'{"props": {}}'))
+        self.assertIsNone(app._decode_account(b'\xff"pageProps"'))
+        with self.assertRaises(app.DecodeError):
+            app.parse_next_data(b'{"pageProps": {"account": ', account_only=True)
+
+    @patch('builtins.print')
+    @patch('app.parse_next_data')
+    @patch('app.grab_next_data', return_value=b"{}")
+    def test_main_json_options(self, mock_grab, mock_parse, mock_print):
+        mock_parse.return_value = {"username": "alice"}
+        with patch('app.ACCOUNT_ONLY', False):
+            app.main(['--username', 'alice', '--stream', '--account-only', '--json-backend', 'json'])
+            self.assertTrue(app.ACCOUNT_ONLY)
+        self.assertEqual(app.json_backend, "json")
+        mock_print.assert_called_once_with('{"username": "alice"}')
+
+
 # Patches are applied in reverse order of arguments
 @patch('app.sys.exit')
+@patch('app.make_session')
 @patch('builtins.print')
 @patch('app.json.dump')
 @patch('app.json.load') # For header file loading
@@ -226,7 +516,7 @@ class TestMainExecution(unittest.TestCase):
     # ...
     # @patch('app.sys.exit') -> mock_sys_exit (last mock arg)
     def test_main_no_username(self, mock_grab_source, mock_parse_html, mock_json_load,
-                              mock_json_dump, mock_print, mock_sys_exit):
+                              mock_json_dump, mock_print, mock_make_session, mock_sys_exit):
 
         mock_sys_exit.side_effect = SystemExit(1) # Make mock sys.exit raise SystemExit with code 1
 
@@ -237,16 +527,18 @@ class TestMainExecution(unittest.TestCase):
         mock_sys_exit.assert_called_once_with(1)
 
     def test_main_with_username_stdout(self, mock_grab_source, mock_parse_html, mock_json_load,
-                                       mock_json_dump, mock_print, mock_sys_exit):
+                                       mock_json_dump, mock_print, mock_make_session, mock_sys_exit):
 
         mock_grab_source.return_value = "dummy_html_source"
         mock_parse_html.return_value = {"user": "testuser", "data": "somedata"}
 
         app.main(['--username', 'testuser'])
 
-        mock_grab_source.assert_called_once_with("testuser", headers=None)
-        mock_parse_html.assert_called_once_with("dummy_html_source")
-        mock_print.assert_called_once_with(json.dumps({"user": "testuser", "data": "somedata"}))
+        mock_make_session.assert_called_once_with(None, pool_size=app.DEFAULT_POOL_SIZE)
+        mock_grab_source.assert_called_once_with("testuser", session=mock_make_session.return_value,
+                                                 timeout=app.DEFAULT_TIMEOUT)
+        mock_parse_html.assert_called_once_with("dummy_html_source", fields=None)
+        mock_print.assert_called_once_with(app.json_dumps({"user": "testuser", "data": "somedata"}).decode())
         mock_json_dump.assert_not_called()
         mock_sys_exit.assert_not_called()
 
@@ -255,7 +547,7 @@ class TestMainExecution(unittest.TestCase):
     @patch('builtins.open', new_callable=MagicMock)
     def test_main_with_username_headers_outfile(self, mock_dev_open, # From this method's decorator
                                                 mock_grab_source, mock_parse_html, mock_json_load,
-                                                mock_json_dump, mock_print, mock_sys_exit): # From class decorators
+                                                mock_json_dump, mock_print, mock_make_session, mock_sys_exit): # From class decorators
 
         # This test uses a local patch for argparse.ArgumentParser to simulate file objects
         # The builtins.open mock (mock_dev_open) is not directly used here due to argparse.FileType handling.
@@ -273,6 +565,22 @@ class TestMainExecution(unittest.TestCase):
             # Simulate the args object that parse_args() would return
             mock_simulated_args = MagicMock()
             mock_simulated_args.username = "testuser"
+            mock_simulated_args.usernames_file = None
+            mock_simulated_args.workers = 8
+            mock_simulated_args.stream = False
+            mock_simulated_args.cache_dir = None
+            mock_simulated_args.base_url = None
+            mock_simulated_args.pool_size = app.DEFAULT_POOL_SIZE
+            mock_simulated_args.connect_timeout, mock_simulated_args.read_timeout = app.DEFAULT_TIMEOUT
+            mock_simulated_args.stats = mock_simulated_args.timing = False
+            mock_simulated_args.json_backend = "json"
+            mock_simulated_args.account_only = False
+            mock_simulated_args.pipeline = False
+            mock_simulated_args.state_db = None
+            mock_simulated_args.only_changed = False
+            mock_simulated_args.journal = None
+            mock_simulated_args.fields = None
+            mock_simulated_args.identities = None
 
             # Create MagicMock instances for file objects
             mock_headers_file = MagicMock() # Using simple MagicMock
@@ -280,10 +588,9 @@ class TestMainExecution(unittest.TestCase):
             mock_headers_file.close = MagicMock() # Add close method
             mock_simulated_args.headersFile = mock_headers_file
 
-            mock_outfile = MagicMock() # Using simple MagicMock
+            mock_simulated_args.outfile = "out.json"
+            mock_outfile = mock_dev_open.return_value
             mock_outfile.name = "out.json"
-            mock_outfile.close = MagicMock() # Add close method
-            mock_simulated_args.outfile = mock_outfile
 
             mock_parser_instance.parse_args.return_value = mock_simulated_args
 
@@ -294,15 +601,1077 @@ class TestMainExecution(unittest.TestCase):
             mock_json_load.assert_called_once_with(mock_headers_file)
             mock_headers_file.close.assert_called_once()
 
-            mock_grab_source.assert_called_once_with("testuser", headers={"X-Test-Header": "true"})
-            mock_parse_html.assert_called_once_with("dummy_html_source_with_headers")
+            mock_make_session.assert_called_once_with({"X-Test-Header": "true"}, pool_size=app.DEFAULT_POOL_SIZE)
+            mock_grab_source.assert_called_once_with("testuser", session=mock_make_session.return_value,
+                                                     timeout=app.DEFAULT_TIMEOUT)
+            mock_parse_html.assert_called_once_with("dummy_html_source_with_headers", fields=None)
 
-            mock_json_dump.assert_called_once_with({"user": "testuser", "data": "with_headers"}, mock_outfile)
+            mock_dev_open.assert_called_once_with("out.json", "w", encoding="utf-8")
+            mock_outfile.write.assert_called_once_with(app.json_dumps({"user": "testuser", "data": "with_headers"}).decode())
             mock_outfile.close.assert_called_once()
 
             mock_print.assert_not_called()
             mock_sys_exit.assert_not_called()
 
 
+class TestMainErrors(unittest.TestCase):
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    @patch('app.grab_source')
+    def test_main_maps_errors_to_exit_codes(self, mock_grab_source, mock_stderr):
+        for error in (app.ProfileNotFound("Profile not found: x", username="x", status=404),
+                      app.RateLimited("slow down", username="x"),
+                      app.FetchError("Timeout Error", username="x"),
+                      app.StructureChanged("no __NEXT_DATA__"),
+                      app.DecodeError("bad json")):
+            mock_grab_source.side_effect = error
+            with self.assertRaises(SystemExit) as cm:
+                app.main(['--username', 'x', '--retries', '0'])
+            self.assertEqual(cm.exception.code, error.exit_code)
+            self.assertIn(str(error), mock_stderr.getvalue())
+        self.assertEqual(len({cls.exit_code for cls in (app.LinktreeError, app.FetchError, app.ProfileNotFound,
+                                                         app.RateLimited, app.StructureChanged, app.DecodeError)}), 6)
+
+    @patch('app.grab_source')
+    def test_scrape_adds_username_to_parse_errors(self, mock_grab_source):
+        mock_grab_source.return_value = "<html>no data here</html>"
+        with self.assertRaises(app.StructureChanged) as cm:
+            app.scrape("someone")
+        self.assertEqual(cm.exception.username, "someone")
+
+
+class TestStartup(unittest.TestCase):
+
+    HEAVY_MODULES = ("requests", "bs4", "lxml", "aiohttp", "asyncio", "zstandard", "orjson", "ujson",
+                     "http.server", "email.utils", "sqlite3", "multiprocessing")
+
+    def _loaded_after(self, code):
+        # Heavy modules in sys.modules after running code in a fresh interpreter
+        check = f"import sys; {code}; print(','.join(m for m in {self.HEAVY_MODULES!r} if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return [m for m in result.stdout.strip().split(",") if m]
+
+    def test_import_and_help_skip_heavy_modules(self):
+        self.assertEqual(self._loaded_after("import app"), [])
+        code = "import app, contextlib, io\nwith contextlib.redirect_stdout(io.StringIO()):\n try: app.main(['--help'])\n except SystemExit: pass"
+        self.assertEqual(self._loaded_after(f"exec({code!r})"), [])
+
+    def test_modules_are_imported_on_first_use(self):
+        self.assertIn("bs4", self._loaded_after("import app; app.bs4.BeautifulSoup"))
+        self.assertIn("requests", self._loaded_after("import app; app.make_session()"))
+
+    def test_lazy_module_attributes_can_be_patched(self):
+        original = requests.Session
+        with patch('app.requests.Session') as mock_session:
+            self.assertIs(app.make_session(), mock_session.return_value)
+            self.assertIs(requests.Session, mock_session)
+        self.assertIs(requests.Session, original)
+
+
+class TestRetryAndRateLimit(unittest.TestCase):
+
+    def test_retry_policy_only_retries_transient_errors(self):
+        policy = app.RetryPolicy(retries=2, max_backoff=10)
+        self.assertTrue(policy.should_retry(app.FetchError("timeout"), 0))
+        self.assertTrue(policy.should_retry(app.FetchError("503", status=503), 1))
+        self.assertTrue(policy.should_retry(app.RateLimited("429", retry_after=5), 0))
+        self.assertFalse(policy.should_retry(app.FetchError("503", status=503), 2)) # Out of attempts
+        self.assertFalse(policy.should_retry(app.FetchError("403", status=403), 0))
+        self.assertFalse(policy.should_retry(app.ProfileNotFound("404", status=404), 0))
+        self.assertFalse(policy.should_retry(app.StructureChanged("changed"), 0))
+        self.assertFalse(policy.should_retry(app.RateLimited("429", retry_after=3600), 0)) # Longer than max_backoff
+
+    def test_retry_policy_delay(self):
+        policy = app.RetryPolicy(backoff=1, max_backoff=5)
+        self.assertEqual(policy.delay(app.RateLimited("429", retry_after=3), 0), 3)
+        for attempt in range(6):
+            self.assertLessEqual(policy.delay(app.FetchError("timeout"), attempt), min(5, 2 ** attempt))
+
+    @patch('app.time.sleep')
+    @patch('app.grab_source')
+    def test_scrape_retries_transient_errors(self, mock_grab_source, mock_sleep):
+        page = _profile_html("flaky")
+        mock_grab_source.side_effect = [app.FetchError("503", status=503),
+                                        app.RateLimited("429", retry_after=2), page]
+        data = app.scrape("flaky", retry=app.RetryPolicy(retries=3))
+        self.assertEqual(data["username"], "flaky")
+        self.assertEqual(mock_grab_source.call_count, 3)
+        self.assertEqual(mock_sleep.call_args_list[-1], unittest.mock.call(2))
+
+    @patch('app.time.sleep')
+    @patch('app.grab_source')
+    def test_scrape_gives_up(self, mock_grab_source, mock_sleep):
+        mock_grab_source.side_effect = app.FetchError("503", status=503)
+        with self.assertRaises(app.FetchError):
+            app.scrape("down", retry=app.RetryPolicy(retries=2))
+        self.assertEqual(mock_grab_source.call_count, 3)
+
+    def test_token_bucket_limits_rate(self):
+        limiter = app.RateLimiter(rate=50, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            with limiter:
+                pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.09) # 5 waits of 1/50s
+
+    def test_concurrency_limit_backs_off_and_recovers(self):
+        limiter = app.RateLimiter(max_concurrency=8, decrease_interval=60)
+        limiter._in_flight = 2
+        limiter.release(app.FetchError("503", status=503))
+        self.assertEqual(limiter.limit, 4)
+        limiter.release(app.FetchError("503", status=503)) # Same burst of errors
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(4):
+            limiter._in_flight += 1
+            limiter.release(None)
+        self.assertEqual(limiter.limit, 5)
+        limiter._in_flight = 5
+        self.assertGreater(limiter._try_acquire(), 0) # At the limit, have to wait
+
+    def test_not_found_does_not_back_off(self):
+        limiter = app.RateLimiter(rate=10, max_concurrency=8)
+        limiter._in_flight = 1
+        limiter.release(app.ProfileNotFound("404", status=404))
+        self.assertEqual((limiter.limit, limiter.rate), (8, 10))
+
+    def test_rate_halves_and_retry_after_pauses_everyone(self):
+        limiter = app.RateLimiter(rate=10, max_concurrency=8)
+        limiter._in_flight = 1
+        limiter.release(app.RateLimited("429", retry_after=30))
+        self.assertEqual(limiter.rate, 5)
+        self.assertGreater(limiter._try_acquire(), 29)
+
+    def test_sync_and_async_retry_against_server(self):
+        with MockLinktreeServer({"busy": _profile_html("busy")}) as server, \
+                patch('app.BASE_URL', server.url):
+            limiter = app.RateLimiter(max_concurrency=4)
+            retry = app.RetryPolicy(retries=2)
+            server.failures["busy"] = [(429, {"Retry-After": "0"}), (503, {})]
+            with patch('app.random.uniform', return_value=0):
+                self.assertEqual(app.scrape("busy", limiter=limiter, retry=retry)["username"], "busy")
+            self.assertEqual(len(server.requests), 3)
+            self.assertEqual(limiter._in_flight, 0)
+
+            server.failures["busy"] = [(429, {"Retry-After": "0"})]
+            data = asyncio.run(app.async_scrape("busy", limiter=limiter, retry=retry))
+            self.assertEqual(data["username"], "busy")
+            self.assertEqual(len(server.requests), 5)
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_read_usernames_skips_blanks_and_comments(self):
+        lines = io.StringIO("alice\n\n  bob  \n# a comment\ncarol\n")
+        self.assertEqual(list(app.read_usernames(lines)), ["alice", "bob", "carol"])
+
+    @patch('app.scrape')
+    def test_scrape_many_reports_failures_per_username(self, mock_scrape):
+        def fake_scrape(username, **kwargs):
+            if username == "bad":
+                raise app.ProfileNotFound("Profile not found: bad", username="bad", status=404)
+            return {"username": username}
+        mock_scrape.side_effect = fake_scrape
+
+        results = {u: (data, error) for u, data, error in
+                   app.scrape_many(["a", "bad", "b", "c"], workers=2)}
+
+        self.assertEqual(set(results), {"a", "bad", "b", "c"})
+        self.assertEqual(results["a"], ({"username": "a"}, None))
+        self.assertIsNone(results["bad"][0])
+        self.assertIsInstance(results["bad"][1], app.ProfileNotFound)
+
+    @patch('app.scrape')
+    def test_scrape_many_consumes_usernames_lazily(self, mock_scrape):
+        mock_scrape.side_effect = lambda username, **kwargs: {"username": username}
+        consumed = []
+        def usernames():
+            for i in range(100):
+                consumed.append(i)
+                yield f"user{i}"
+
+        results = app.scrape_many(usernames(), workers=2)
+        next(results)
+        self.assertLessEqual(len(consumed), 5) # At most workers * 2 in flight (+1 on refill)
+        self.assertEqual(len(list(results)), 99)
+
+    @patch('app.scrape')
+    def test_run_batch_writes_json_lines(self, mock_scrape):
+        mock_scrape.side_effect = lambda username, **kwargs: {"username": username}
+        out = io.BytesIO()
+        with app.JSONLinesWriter(out) as writer:
+            failures = app.run_batch(["a", "b"], writer, workers=1)
+        self.assertEqual(failures, 0)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(sorted(d["username"] for d in lines), ["a", "b"])
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    @patch('app.scrape')
+    def test_run_batch_writes_error_records(self, mock_scrape, mock_stderr):
+        def fake_scrape(username, **kwargs):
+            if username == "bad":
+                raise ValueError("broken page")
+            return {"username": username}
+        mock_scrape.side_effect = fake_scrape
+        out = io.BytesIO()
+        with app.JSONLinesWriter(out) as writer:
+            failures = app.run_batch(["good", "bad"], writer, workers=1)
+        self.assertEqual(failures, 1)
+        records = {r["username"]: r for r in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(records["bad"], {"username": "bad", "status": "error", "error": "broken page",
+                                          "error_type": "ValueError", "http_status": None})
+        self.assertEqual(records["good"], {"username": "good"})
+        self.assertIn("bad", mock_stderr.getvalue())
+
+    @patch('app.scrape')
+    def test_main_usernames_file(self, mock_scrape):
+        mock_scrape.side_effect = lambda username, **kwargs: {"username": username}
+        with tempfile.TemporaryDirectory() as tmp:
+            names = os.path.join(tmp, "names.txt")
+            out = os.path.join(tmp, "out.jsonl")
+            with open(names, "w") as f:
+                f.write("alice\nbob\n")
+            app.main(['--usernames-file', names, '--outfile', out, '--workers', '2'])
+            with open(out) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(sorted(d["username"] for d in lines), ["alice", "bob"])
+
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        pages = {f"user{i}": _profile_html(f"user{i}", [("site", f"http://example.com/{i}")])
+                 for i in range(12)}
+        pages["broken"] = "<html><body>No data here</body></html>"
+        self.server, self.session = _serve_pages(self, pages)
+
+    def test_grab_source_as_bytes(self):
+        source = app.grab_source("user1", session=self.session, as_bytes=True)
+        self.assertIsInstance(source, bytes)
+        self.assertEqual(app.parse_html(source)["username"], "user1")
+
+    def test_pipeline_scrape_many(self):
+        usernames = [f"user{i}" for i in range(12)] + ["missing", "broken"]
+        stats = app.Stats()
+        results = {u: (data, error) for u, data, error in app.pipeline_scrape_many(
+            usernames, fetch_workers=2, parse_workers=2, queue_size=1, session=self.session, stats=stats)}
+        self.assertEqual(set(results), set(usernames))
+        self.assertEqual(results["user7"][0]["links"], [{"Site": "http://example.com/7"}])
+        self.assertIsInstance(results["missing"][1], app.ProfileNotFound)
+        self.assertIsInstance(results["broken"][1], app.StructureChanged)
+        self.assertEqual(results["broken"][1].username, "broken")
+        self.assertEqual(stats.counters["profiles"], 12)
+        self.assertEqual(stats.counters["errors"], 2)
+        self.assertEqual(stats.timers["parse"][0], 12)
+
+    @patch('app._parse_source')
+    @patch('app._timed_fetch')
+    @patch('app.make_parse_pool')
+    def test_pipeline_bounds_pages_waiting_for_parsers(self, mock_pool, mock_fetch, mock_parse):
+        # Instant fetches and a slow parser: pages that have been fetched but
+        # not parsed yet must stay within fetch_workers * 2 + queue_size
+        mock_pool.side_effect = lambda workers: ThreadPoolExecutor(max_workers=1)
+        counts = {"fetched": 0, "parsed": 0, "waiting": 0}
+        lock = threading.Lock()
+        def fake_fetch(username, **kwargs):
+            with lock:
+                counts["fetched"] += 1
+            return username.encode(), 0.0
+        def fake_parse(source, payload, timed, fields):
+            with lock:
+                counts["waiting"] = max(counts["waiting"], counts["fetched"] - counts["parsed"])
+            time.sleep(0.002)
+            with lock:
+                counts["parsed"] += 1
+            return {"username": source.decode()}, {}
+        mock_fetch.side_effect = fake_fetch
+        mock_parse.side_effect = fake_parse
+        results = list(app.pipeline_scrape_many([f"user{i}" for i in range(200)],
+                                                fetch_workers=2, parse_workers=1, queue_size=1))
+        self.assertEqual(len(results), 200)
+        self.assertLessEqual(counts["waiting"], 2 * 2 + 1)
+
+    def test_pipeline_stream_and_settings(self):
+        # Parse processes use this process' JSON settings
+        with patch('app.ACCOUNT_ONLY', True):
+            results = list(app.pipeline_scrape_many(["user1", "user2"], parse_workers=1, stream=True,
+                                                    timing=True, session=self.session))
+        self.assertEqual(sorted(data["username"] for _, data, _ in results), ["user1", "user2"])
+        self.assertIn("timing", results[0][1])
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_pipeline(self, mock_stderr):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = os.path.join(tmp, "names.txt")
+            out = os.path.join(tmp, "out.jsonl")
+            with open(names, "w") as f:
+                f.write("user1\nuser2\nuser3\n")
+            app.main(['--usernames-file', names, '--outfile', out, '--pipeline', '--parse-workers', '2'])
+            with open(out) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(sorted(d["username"] for d in lines), ["user1", "user2", "user3"])
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_pipeline_async(self, mock_stderr):
+        with self.assertRaises(SystemExit):
+            app.main(['--usernames-file', '-', '--pipeline', '--async'])
+
+
+class TestChangeDetection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = os.path.join(self.tmp.name, "state.db")
+        self.pages = {f"user{i}": _profile_html(f"user{i}", [("site", f"http://example.com/{i}")])
+                      for i in range(3)}
+        self.server, self.session = _serve_pages(self, self.pages)
+
+    def test_record(self):
+        with app.StateStore(self.db) as state:
+            info = {"username": "alice", "description": "Bio", "links": [{"One": "http://one"}]}
+            self.assertEqual(state.record("alice", info, "h1"), ("new", None))
+            self.assertEqual(state.record("Alice", dict(info, timing={"fetch": 1}), "h2"), ("unchanged", None))
+            self.assertEqual(state.unchanged("alice", "h2"), {**info, "profilePictureUrl": None})
+            self.assertIsNone(state.unchanged("alice", "h1"))
+            changed = dict(info, description="New bio", links=[{"Two": "http://two"}])
+            self.assertEqual(state.record("alice", changed), ("changed", {
+                "fields": ["description", "links"],
+                "links_added": [{"Two": "http://two"}],
+                "links_removed": [{"One": "http://one"}],
+            }))
+            self.assertTrue(state.remove("alice"))
+            self.assertFalse(state.remove("alice"))
+            state.record("bob", {"username": "bob"})
+        with app.StateStore(self.db) as state: # Committed on close
+            self.assertEqual(state.get("bob").info["username"], "bob")
+
+    def test_state_is_committed_with_the_output(self):
+        state = app.StateStore(self.db, commit_every=None)
+        writer = app.JSONLinesWriter(io.BytesIO(), flush_interval=3600, state=state)
+        for username in ("alice", "bob"):
+            state.record(username, {"username": username})
+        state.record("carol", {"username": "carol"})
+        state.commit(["carol"])
+        self.assertTrue(state.remove("carol"))
+        self.assertIsNone(state.get("carol")) # Held back changes are seen by this run
+        writer.write({"username": "alice", "change": "new"}, "alice")
+        with app.StateStore(self.db) as other:
+            self.assertIsNone(other.get("alice"))
+        writer.flush()
+        state.close() # A crash before bob's record was written
+        with app.StateStore(self.db) as other:
+            self.assertEqual(other.get("alice").info["username"], "alice")
+            self.assertIsNone(other.get("bob"))
+            self.assertEqual(other.get("carol").info["username"], "carol")
+
+    def test_scrape(self):
+        with app.StateStore(self.db) as state:
+            self.assertEqual(app.scrape("user1", state=state, session=self.session)["change"], "new")
+            stats = app.Stats()
+            with patch('app._parse_source') as mock_parse:
+                data = app.scrape("user1", state=state, stats=stats, session=self.session)
+                mock_parse.assert_not_called()
+            self.assertEqual((data["change"], data["links"]), ("unchanged", [{"Site": "http://example.com/1"}]))
+            self.assertEqual(stats.counters["parses_skipped"], 1)
+
+            self.pages["user1"] = _profile_html("user1", [("site", "http://example.com/1"), ("shop", "http://shop")])
+            data = app.scrape("user1", state=state, stream=True, session=self.session)
+            self.assertEqual(data["change"], "changed")
+            self.assertEqual(data["diff"], {"fields": ["links"], "links_added": [{"Shop": "http://shop"}],
+                                            "links_removed": []})
+
+            del self.pages["user1"]
+            self.assertEqual(app.scrape("user1", state=state, session=self.session),
+                             {"username": "user1", "change": "removed"})
+            with self.assertRaises(app.ProfileNotFound):
+                app.scrape("user1", state=state, session=self.session)
+
+    def test_pipeline_and_async(self):
+        with app.StateStore(self.db) as state:
+            app.scrape("user0", state=state, session=self.session)
+            results = {u: data for u, data, _ in app.pipeline_scrape_many(
+                ["user0", "user1"], parse_workers=1, state=state, session=self.session)}
+            self.assertEqual({u: d["change"] for u, d in results.items()}, {"user0": "unchanged", "user1": "new"})
+            self.assertEqual(asyncio.run(app.async_scrape("user1", state=state))["change"], "unchanged")
+            self.assertEqual(asyncio.run(app.async_scrape("user2", state=state))["change"], "new")
+            del self.pages["user2"]
+            self.assertEqual(asyncio.run(app.async_scrape("user2", state=state))["change"], "removed")
+
+    def test_scrape_with_fields(self):
+        # The selected fields are what is stored and compared
+        def page(social):
+            next_data = {"props": {"pageProps": {"account": {
+                "username": "bob", "links": [{"id": 1, "title": "One", "url": "http://one"}],
+                "socialLinks": [{"type": social}]}}}}
+            return ('<html><body><script id="__NEXT_DATA__" type="application/json">'
+                    f'{json.dumps(next_data)}</script></body></html>')
+        self.pages["bob"] = page("INSTAGRAM")
+        fields = app.compile_fields("links.id,socialLinks")
+        with app.StateStore(self.db) as state:
+            self.assertEqual(app.scrape("bob", state=state, fields=fields, session=self.session)["change"], "new")
+            self.assertEqual(app.scrape("bob", state=state, fields=fields, session=self.session), {
+                "username": "bob", "links": [{"id": 1}], "socialLinks": [{"type": "INSTAGRAM"}],
+                "change": "unchanged"})
+            self.pages["bob"] = page("TIKTOK")
+            data = app.scrape("bob", state=state, fields=fields, session=self.session)
+            self.assertEqual((data["change"], data["diff"]["fields"]), ("changed", ["socialLinks"]))
+            # A different selection isn't answered with the profile stored for this one
+            data = app.scrape("bob", state=state, fields="socialLinks", session=self.session)
+            self.assertEqual((data["change"], set(data)), ("changed", {"username", "socialLinks", "change", "diff"}))
+
+    def test_scrape_with_fields_non_profile_page(self):
+        # A page without an account object is a structure change, not a stored empty selection
+        self.pages["bob"] = ('<html><body><script id="__NEXT_DATA__" type="application/json">'
+                             '{"props": {"pageProps": {"account": null}}}</script></body></html>')
+        with app.StateStore(self.db) as state:
+            with self.assertRaises(app.StructureChanged):
+                app.scrape("bob", state=state, fields="links.id", session=self.session)
+            self.assertIsNone(state.get("bob"))
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_only_changed(self, mock_stderr):
+        names = os.path.join(self.tmp.name, "names.txt")
+        out = os.path.join(self.tmp.name, "out.jsonl")
+        with open(names, "w") as f:
+            f.write("user0\nuser1\nuser2\n")
+        def run():
+            app.main(['--usernames-file', names, '--outfile', out, '--state-db', self.db, '--only-changed'])
+            with open(out) as f:
+                return {d["username"]: d["change"] for d in map(json.loads, f)}
+        self.assertEqual(run(), {"user0": "new", "user1": "new", "user2": "new"})
+        self.assertEqual(run(), {})
+        self.pages["user0"] = _profile_html("user0", [("other", "http://other")])
+        self.assertEqual(run(), {"user0": "changed"})
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_only_changed_needs_state_db(self, mock_stderr):
+        with self.assertRaises(SystemExit):
+            app.main(['--username', 'user0', '--only-changed'])
+
+
+class TestJSONLinesWriter(unittest.TestCase):
+
+    def _line(self, n):
+        return app.json_dumps({"n": n}) + b"\n"
+
+    def test_buffers_until_flush_every(self):
+        out = io.BytesIO()
+        writer = app.JSONLinesWriter(out, flush_every=3, flush_interval=3600)
+        writer.write({"n": 1})
+        writer.write({"n": 2})
+        self.assertEqual(out.getvalue(), b"")
+        writer.write({"n": 3})
+        self.assertEqual(out.getvalue().count(b"\n"), 3)
+        writer.write({"n": 4})
+        writer.close()
+        self.assertEqual([json.loads(l)["n"] for l in out.getvalue().splitlines()], [1, 2, 3, 4])
+
+    def test_flush_interval(self):
+        out = io.BytesIO()
+        writer = app.JSONLinesWriter(out, flush_every=1000, flush_interval=0)
+        writer.write({"n": 1})
+        self.assertEqual(out.getvalue(), self._line(1))
+
+    def test_text_stream_is_written_through_buffer(self):
+        out = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        with app.JSONLinesWriter(out) as writer:
+            writer.write({"n": 1})
+        self.assertEqual(out.buffer.getvalue(), self._line(1))
+
+    def test_gzip(self):
+        out = io.BytesIO()
+        with app.JSONLinesWriter(out, compression="gzip", flush_every=1) as writer:
+            writer.write({"n": 1})
+            self.assertEqual(zlib.decompressobj(31).decompress(out.getvalue()), self._line(1)) # Readable mid-run
+            writer.write({"n": 2})
+        self.assertEqual(gzip.decompress(out.getvalue()), self._line(1) + self._line(2))
+
+    @unittest.skipUnless(app.zstandard, "zstandard is not installed")
+    def test_zstd(self):
+        out = io.BytesIO()
+        with app.JSONLinesWriter(out, compression="zstd") as writer:
+            writer.write({"n": 1})
+        with app.zstandard.ZstdDecompressor().stream_reader(io.BytesIO(out.getvalue())) as reader:
+            self.assertEqual(reader.read(), self._line(1))
+
+    def test_compression_for(self):
+        self.assertEqual(app.compression_for("out.jsonl.gz"), "gzip")
+        self.assertEqual(app.compression_for("out.jsonl.zst"), "zstd")
+        self.assertIsNone(app.compression_for("out.jsonl"))
+
+    @patch('app.scrape')
+    def test_main_compresses_by_extension(self, mock_scrape):
+        mock_scrape.side_effect = lambda username, **kwargs: {"username": username}
+        with tempfile.TemporaryDirectory() as tmp:
+            names = os.path.join(tmp, "names.txt")
+            out = os.path.join(tmp, "out.jsonl.gz")
+            with open(names, "w") as f:
+                f.write("alice\nbob\n")
+            app.main(['--usernames-file', names, '--outfile', out])
+            with gzip.open(out, "rt") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(sorted(d["username"] for d in lines), ["alice", "bob"])
+
+
+class TestCheckpointJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "journal")
+
+    def test_reload(self):
+        journal = app.CheckpointJournal(self.path)
+        journal.append([["alice", "ok"], ["bob", "error"]], 100)
+        journal.append([["carol", "skipped"]], 150)
+        journal.close()
+        with open(self.path, "ab") as f:
+            f.write(b'{"offset": 200, "done": [["da') # Torn by a crash
+        journal = app.CheckpointJournal(self.path)
+        self.assertEqual(journal.done, {"alice": "ok", "bob": "error", "carol": "skipped"})
+        self.assertEqual(journal.offset, 150)
+        journal.append([["dave", "ok"]], 200)
+        journal.close()
+        self.assertEqual(app.CheckpointJournal(self.path).offset, 200)
+
+    def test_writer_journals_after_flush(self):
+        out_path = os.path.join(self.tmp.name, "out.jsonl")
+        journal = app.CheckpointJournal(self.path)
+        with open(out_path, "wb") as out:
+            writer = app.JSONLinesWriter(out, flush_every=2, flush_interval=3600, journal=journal)
+            writer.write({"username": "alice"}, "alice")
+            writer.skip("bob")
+            self.assertEqual(os.path.getsize(self.path), 0)
+            writer.write_error("carol", app.ProfileNotFound("gone"))
+            size = os.path.getsize(out_path)
+            writer.close()
+        journal.close()
+        journal = app.CheckpointJournal(self.path)
+        self.assertEqual(journal.done, {"alice": "ok", "bob": "skipped", "carol": "error"})
+        self.assertEqual(journal.offset, size)
+        with self.assertRaises(ValueError):
+            app.JSONLinesWriter(io.BytesIO(), compression="gzip", journal=journal)
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_resume(self, mock_stderr):
+        pages = {f"user{i}": _profile_html(f"user{i}") for i in range(4)}
+        names = os.path.join(self.tmp.name, "names.txt")
+        out = os.path.join(self.tmp.name, "out.jsonl")
+        with MockLinktreeServer(pages) as server, patch('app.BASE_URL', server.url):
+            with open(names, "w") as f:
+                f.write("user0\nuser1\nmissing\n")
+            with self.assertRaises(SystemExit): # "missing" failed
+                app.main(['--usernames-file', names, '--outfile', out, '--journal', self.path, '--retries', '0'])
+            # Simulate a crash: a record written after the last journal entry
+            with open(out, "ab") as f:
+                f.write(b'{"username": "user2"}\n{"userna')
+            with open(names, "w") as f:
+                f.write("user0\nuser1\nmissing\nuser2\nuser3\n")
+            server.requests.clear()
+            app.main(['--usernames-file', names, '--outfile', out, '--journal', self.path])
+            self.assertEqual(sorted(path for path, _ in server.requests), ["/user2", "/user3"])
+        with open(out) as f:
+            usernames = [json.loads(line)["username"] for line in f]
+        self.assertEqual(sorted(usernames), ["missing", "user0", "user1", "user2", "user3"])
+        self.assertIn("Resuming: 3 username(s) already done", mock_stderr.getvalue())
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_empty_journal_starts_output_over(self, mock_stderr):
+        pages = {name: _profile_html(name) for name in "abc"}
+        names = os.path.join(self.tmp.name, "names.txt")
+        out = os.path.join(self.tmp.name, "out.jsonl")
+        with open(names, "w") as f:
+            f.write("a\nb\nc\n")
+        with open(out, "w") as f:
+            f.write('{"username": "a"}\n') # Written before a crash, never journaled
+        open(self.path, "w").close()
+        with MockLinktreeServer(pages) as server, patch('app.BASE_URL', server.url):
+            app.main(['--usernames-file', names, '--outfile', out, '--journal', self.path])
+        with open(out) as f:
+            usernames = [json.loads(line)["username"] for line in f]
+        self.assertEqual(sorted(usernames), ["a", "b", "c"])
+        self.assertNotIn("Resuming", mock_stderr.getvalue())
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_journal_needs_plain_outfile(self, mock_stderr):
+        names = os.path.join(self.tmp.name, "names.txt")
+        with open(names, "w") as f:
+            f.write("user0\n")
+        for outfile in ([], ['--outfile', os.path.join(self.tmp.name, "out.jsonl.gz")]):
+            with self.assertRaises(SystemExit):
+                app.main(['--usernames-file', names, '--journal', self.path, *outfile])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_main_outfile_stdout_keeps_appended_output(self):
+        # `app.py --outfile - >> log` must not wipe log
+        log = os.path.join(self.tmp.name, "log")
+        with open(log, "w") as f:
+            f.write("keep\n")
+        with MockLinktreeServer({"alice": _profile_html("alice")}) as server, open(log, "a") as stdout:
+            subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+                            "--username", "alice", "--outfile", "-", "--base-url", server.url],
+                           stdout=stdout, check=True)
+        with open(log) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "keep")
+        self.assertEqual(json.loads(lines[1])["username"], "alice")
+
+    @patch('app.scrape', return_value={"username": "alice"})
+    def test_main_overwrites_outfile(self, mock_scrape):
+        out = os.path.join(self.tmp.name, "out.json")
+        with open(out, "w") as f:
+            f.write("old contents that are longer than the new ones")
+        app.main(['--username', 'alice', '--outfile', out])
+        with open(out) as f:
+            self.assertEqual(json.load(f), {"username": "alice"})
+
+
+def _profile_html(username, links=()):
+    next_data = {"props": {"pageProps": {"account": {
+        "username": username,
+        "description": None,
+        "profilePictureUrl": None,
+        "links": [{"title": title, "url": url} for title, url in links],
+    }}}}
+    return ('<html><head></head><body><script id="__NEXT_DATA__" type="application/json" '
+            f'crossorigin="anonymous">{json.dumps(next_data)}</script></body></html>')
+
+
+def _serve_pages(test, pages):
+    # Starts a MockLinktreeServer for the test, points app.BASE_URL at it and
+    # returns it with a session, all closed again on cleanup
+    server = MockLinktreeServer(pages).__enter__()
+    test.addCleanup(server.__exit__)
+    patcher = patch('app.BASE_URL', server.url)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    session = app.make_session()
+    test.addCleanup(session.close)
+    return server, session
+
+
+class MockProxy:
+    # Local stand-in for an HTTP proxy: forwards GET requests for absolute
+    # URLs, or answers all of them with fail_status when that is set
+
+    def __init__(self):
+        self.requests = []
+        self.fail_status = None
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                proxy.requests.append(self.path)
+                if proxy.fail_status:
+                    status, body = proxy.fail_status, b""
+                else:
+                    url = urlsplit(self.path)
+                    upstream = http.client.HTTPConnection(url.netloc, timeout=5)
+                    upstream.request("GET", url.path, headers={k: v for k, v in self.headers.items()
+                                                               if k.lower() not in ("host", "proxy-connection")})
+                    response = upstream.getresponse()
+                    status, body = response.status, response.read()
+                    upstream.close()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        pages = {f"user{i}": _profile_html(f"user{i}", [("site", f"http://example.com/{i}")])
+                 for i in range(20)}
+        self.server, _ = _serve_pages(self, pages)
+
+    def test_async_grab_source(self):
+        source = asyncio.run(app.async_grab_source("user1", headers={"X-Test-Header": "true"}))
+        self.assertIn("__NEXT_DATA__", source)
+        self.assertEqual(self.server.requests[0][1]["X-Test-Header"], "true")
+
+    def test_async_grab_source_http_error(self):
+        with self.assertRaises(app.ProfileNotFound) as cm:
+            asyncio.run(app.async_grab_source("missing"))
+        self.assertEqual((cm.exception.username, cm.exception.status), ("missing", 404))
+
+    def test_async_grab_source_stream(self):
+        payload = asyncio.run(app.async_grab_source("user3", stream=True))
+        self.assertEqual(json.loads(payload)["props"]["pageProps"]["account"]["username"], "user3")
+
+    def test_async_scrape(self):
+        async def run():
+            async with app.make_async_session() as session:
+                return await app.async_scrape("user2", session=session, semaphore=asyncio.Semaphore(1))
+        data = asyncio.run(run())
+        self.assertEqual(data["username"], "user2")
+        self.assertEqual(data["links"], [{"Site": "http://example.com/2"}])
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_async_scrape_many(self, mock_stderr):
+        async def run():
+            usernames = [f"user{i}" for i in range(20)] + ["missing"]
+            return [r async for r in app.async_scrape_many(usernames, concurrency=4)]
+        results = {u: (data, error) for u, data, error in asyncio.run(run())}
+        self.assertEqual(len(results), 21)
+        self.assertEqual(results["user7"][0]["username"], "user7")
+        self.assertIsInstance(results["missing"][1], app.ProfileNotFound)
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_async_batch(self, mock_stderr):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = os.path.join(tmp, "names.txt")
+            out = os.path.join(tmp, "out.jsonl")
+            with open(names, "w") as f:
+                f.write("user1\nuser2\nuser3\n")
+            app.main(['--usernames-file', names, '--outfile', out, '--async', '--concurrency', '2'])
+            with open(out) as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(sorted(d["username"] for d in lines), ["user1", "user2", "user3"])
+
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pages = {"alice": _profile_html("alice", [("one", "http://one")])}
+        self.server, self.session = _serve_pages(self, self.pages)
+
+    def test_fresh_entry_skips_request(self):
+        cache = app.ResponseCache(self.tmp.name, ttl=60)
+        first = app.scrape("alice", cache=cache, session=self.session)
+        second = app.scrape("ALICE", cache=cache, session=self.session) # Case-insensitive key
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stale_entry_is_revalidated(self):
+        cache = app.ResponseCache(self.tmp.name, ttl=0)
+        app.scrape("alice", cache=cache, session=self.session)
+        data = app.scrape("alice", cache=cache, session=self.session)
+        self.assertEqual(data["username"], "alice")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn("If-None-Match", self.server.requests[1][1])
+
+        # A changed page is downloaded and replaces the cached one
+        self.pages["alice"] = _profile_html("alice", [("two", "http://two")])
+        data = app.scrape("alice", cache=cache, session=self.session)
+        self.assertEqual(data["links"], [{"Two": "http://two"}])
+
+    def test_bypass_refetches_but_stores(self):
+        app.scrape("alice", cache=app.ResponseCache(self.tmp.name), session=self.session)
+        bypass = app.ResponseCache(self.tmp.name, bypass=True)
+        app.scrape("alice", cache=bypass, session=self.session)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertNotIn("If-None-Match", self.server.requests[1][1])
+        self.assertIsNotNone(app.ResponseCache(self.tmp.name).get("alice"))
+
+    def test_lru_eviction(self):
+        cache = app.ResponseCache(self.tmp.name, max_size=700) # Room for two ~290 byte entries
+        cache.put("old", b"x" * 200)
+        cache.put("used", b"x" * 200)
+        past = time.time() - 100
+        os.utime(cache._path("old"), (past, past))
+        os.utime(cache._path("used"), (past, past))
+        cache.get("used") # Touch, so "old" is now the least recently used
+        cache.put("new", b"x" * 200)
+        self.assertIsNone(cache.get("old"))
+        self.assertIsNotNone(cache.get("used"))
+        self.assertIsNotNone(cache.get("new"))
+        self.assertEqual(app.ResponseCache(self.tmp.name, max_size=700)._size, cache._size)
+
+    def test_async_uses_cache(self):
+        cache = app.ResponseCache(self.tmp.name, ttl=60)
+        async def run():
+            async with app.make_async_session() as session:
+                first = await app.async_scrape("alice", session=session, cache=cache)
+                second = await app.async_scrape("alice", session=session, cache=cache)
+                return first, second
+        first, second = asyncio.run(run())
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.server.requests), 1)
+
+    @patch('builtins.print')
+    def test_main_base_url(self, mock_print):
+        with patch('app.BASE_URL', "https://linktr.ee"):
+            app.main(['--username', 'alice', '--base-url', self.server.url + "/"])
+        self.assertEqual(self.server.requests[0][0], "/alice")
+        self.assertIn('"alice"', mock_print.call_args[0][0])
+
+    @patch('builtins.print')
+    def test_main_cache_dir(self, mock_print):
+        args = ['--username', 'alice', '--cache-dir', self.tmp.name]
+        app.main(args)
+        app.main(args)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(mock_print.call_args_list[0], mock_print.call_args_list[1])
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        pages = {f"user{i}": _profile_html(f"user{i}", [("site", f"http://example.com/{i}")])
+                 for i in range(5)}
+        self.upstream, session = _serve_pages(self, pages)
+        self.service = app.ProfileService(ttl=60, session=session, retry=app.RetryPolicy(retries=0))
+        self.server = app.make_server(("127.0.0.1", 0), self.service, workers=4)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def test_get_profile(self):
+        r = requests.get(self.url + "/profile/user1")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()["links"], [{"Site": "http://example.com/1"}])
+
+    def test_not_found(self):
+        r = requests.get(self.url + "/profile/missing")
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(r.json()["error_type"], "ProfileNotFound")
+        self.assertEqual(requests.get(self.url + "/nothing").status_code, 404)
+
+    def test_rate_limited(self):
+        self.upstream.failures["user2"] = [(429, {"Retry-After": "7"})]
+        r = requests.get(self.url + "/profile/user2")
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(r.headers["Retry-After"], "7")
+        # Errors are not remembered
+        self.assertEqual(requests.get(self.url + "/profile/user2").status_code, 200)
+
+    def test_memory_cache(self):
+        requests.get(self.url + "/profile/user1")
+        r = requests.get(self.url + "/profile/USER1")
+        self.assertEqual(r.json()["username"], "user1")
+        self.assertEqual(len(self.upstream.requests), 1)
+
+    def test_memory_cache_expires(self):
+        self.service.ttl = 0
+        requests.get(self.url + "/profile/user1")
+        requests.get(self.url + "/profile/user1")
+        self.assertEqual(len(self.upstream.requests), 2)
+
+    def test_memory_cache_max_entries(self):
+        self.service.max_entries = 2
+        for username in ("user0", "user1", "user0", "user2"):
+            self.service.get(username)
+        self.assertEqual(list(self.service._profiles), ["user0", "user2"])
+
+    def test_coalescing(self):
+        self.upstream.latency = 0.2
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: requests.get(self.url + "/profile/user3"), range(8)))
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertEqual(len(self.upstream.requests), 1)
+
+    def test_batch(self):
+        r = requests.post(self.url + "/profiles", json={"usernames": ["user1", "missing", "user4"]})
+        self.assertEqual(r.status_code, 200)
+        results = r.json()["results"]
+        self.assertEqual([d["username"] for d in results], ["user1", "missing", "user4"])
+        self.assertEqual(results[1]["status"], "error")
+        self.assertEqual(results[1]["http_status"], 404)
+
+    def test_batch_bad_request(self):
+        self.assertEqual(requests.post(self.url + "/profiles", data=b"{").status_code, 400)
+        self.assertEqual(requests.post(self.url + "/profiles", json={"usernames": "user1"}).status_code, 400)
+        with patch('app.MAX_BATCH_USERNAMES', 1):
+            self.assertEqual(requests.post(self.url + "/profiles", json=["user1", "user2"]).status_code, 413)
+
+    def test_health(self):
+        self.assertEqual(requests.get(self.url + "/health").json(), {"status": "ok"})
+
+    def test_metrics(self):
+        self.upstream.latency = 0.1
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            list(pool.map(lambda _: requests.get(self.url + "/profile/user1"), range(3)))
+        requests.get(self.url + "/profile/user1")
+        r = requests.get(self.url + "/metrics")
+        self.assertTrue(r.headers["Content-Type"].startswith("text/plain"))
+        lines = r.text.splitlines()
+        self.assertIn('linktree_stage_seconds_count{stage="fetch"} 1', lines)
+        self.assertIn("linktree_profiles_total 1", lines)
+        self.assertIn("linktree_coalesced_total 2", lines)
+        self.assertIn("linktree_memory_hits_total 1", lines)
+
+
+class TestIdentities(unittest.TestCase):
+
+    def setUp(self):
+        pages = {f"user{i}": _profile_html(f"user{i}") for i in range(4)}
+        self.upstream, _ = _serve_pages(self, pages)
+        self.proxies = [MockProxy().__enter__() for _ in range(2)]
+        for proxy in self.proxies:
+            self.addCleanup(proxy.__exit__)
+
+    def _pool(self, **config):
+        return app.make_identity_pool({**config, "identities": [
+            {"name": f"p{i}", "proxy": proxy.url, "headers": {"User-Agent": f"agent{i}"}}
+            for i, proxy in enumerate(self.proxies)]})
+
+    def test_round_robin_and_lru(self):
+        pool = app.IdentityPool([app.Identity(name, headers={"X": name}) for name in "abc"], max_failures=1)
+        self.assertEqual([pool.acquire().name for _ in range(4)], ["a", "b", "c", "a"])
+
+        pool = app.IdentityPool([app.Identity(name, headers={"X": name}) for name in "abc"],
+                                strategy="lru", max_failures=1)
+        a, b, c = [pool.acquire() for _ in range(3)]
+        pool.report(a, app.RateLimited("slow down"))
+        self.assertEqual([pool.acquire().name for _ in range(3)], ["b", "c", "b"])
+        a.quarantined_until = 0 # Quarantine over: a is now the least recently used
+        self.assertEqual(pool.acquire().name, "a")
+
+    def test_repeated_failures_quarantine_an_identity(self):
+        stats = app.Stats()
+        a, b = app.Identity("a", headers={"X": "a"}), app.Identity("b", headers={"X": "b"})
+        pool = app.IdentityPool([a, b], max_failures=2, quarantine=0.05, stats=stats)
+        pool.report(a, app.FetchError("Timeout Error"))
+        pool.report(a) # A success in between starts the count again
+        pool.report(a, app.FetchError("Timeout Error"))
+        pool.report(a, app.ProfileNotFound("Profile not found: x", status=404)) # Not the identity's fault either
+        pool.report(a, app.FetchError("Timeout Error"))
+        self.assertEqual(a.quarantines, 0)
+        pool.report(a, app.FetchError("Forbidden", status=403))
+        self.assertEqual(a.quarantines, 1)
+        self.assertEqual({pool.acquire().name for _ in range(3)}, {"b"})
+        for _ in range(2):
+            pool.report(b, app.FetchError("Service Unavailable", status=503))
+        self.assertEqual(pool.acquire().name, "a") # Waits for a's quarantine to end
+        self.assertEqual(stats.counters["quarantines"], 2)
+
+    def test_requests_are_spread_over_proxies_and_headers(self):
+        pool = self._pool()
+        results = list(app.scrape_many([f"user{i}" for i in range(4)], workers=1, identities=pool))
+        self.assertEqual(sorted(data["username"] for _, data, error in results), [f"user{i}" for i in range(4)])
+        self.assertEqual([len(proxy.requests) for proxy in self.proxies], [2, 2])
+        agents = sorted(headers["User-Agent"] for _, headers in self.upstream.requests)
+        self.assertEqual(agents, ["agent0", "agent0", "agent1", "agent1"])
+
+    def test_failing_proxy_is_quarantined_and_retried_elsewhere(self):
+        self.proxies[0].fail_status = 502
+        pool = self._pool(max_failures=1, quarantine=60)
+        retry = app.RetryPolicy(retries=1, backoff=0)
+        results = list(app.scrape_many([f"user{i}" for i in range(4)], workers=1, identities=pool, retry=retry))
+        self.assertEqual([error for _, _, error in results], [None] * 4)
+        self.assertEqual(len(self.proxies[0].requests), 1)
+        self.assertEqual(pool.identities[0].quarantines, 1)
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_identities_file(self, mock_stderr):
+        with self.assertRaises(ValueError):
+            app.make_identity_pool({"identities": [{"name": "no headers or proxy"}]})
+        with self.assertRaises(ValueError):
+            app.make_identity_pool({"strategy": "random", "identities": [{"proxy": self.proxies[0].url}]})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "identities.json")
+            with open(path, "w") as f:
+                json.dump([{"proxy": proxy.url} for proxy in self.proxies], f)
+            out = os.path.join(tmp, "out.json")
+            app.main(["--username", "user1", "--identities", path, "--outfile", out])
+            with open(out) as f:
+                self.assertEqual(json.load(f)["username"], "user1")
+            self.assertEqual(sum(len(proxy.requests) for proxy in self.proxies), 1)
+            with self.assertRaises(SystemExit):
+                app.main(["--usernames-file", path, "--identities", path, "--async"])
+        self.assertIn("--identities can't be used with --async", mock_stderr.getvalue())
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.upstream, self.session = _serve_pages(self, {"alice": _profile_html("alice", [("one", "http://one")])})
+
+    def test_stats(self):
+        stats = app.Stats()
+        stats.incr("retries")
+        stats.incr("retries", 2)
+        stats.observe("fetch", 0.5)
+        stats.observe("fetch", 0.25)
+        with stats.timer("parse"):
+            pass
+        self.assertEqual(stats.counters, {"retries": 3})
+        self.assertEqual(stats.timers["fetch"], [2, 0.75, 0.5])
+        self.assertEqual(stats.timers["parse"][0], 1)
+        self.assertIn("retries: 3", stats.summary())
+        metrics = stats.prometheus().splitlines()
+        self.assertIn('linktree_stage_seconds_sum{stage="fetch"} 0.75', metrics)
+        self.assertIn('linktree_stage_seconds_max{stage="fetch"} 0.5', metrics)
+        self.assertIn("linktree_retries_total 3", metrics)
+
+    def test_scrape_records_stages(self):
+        stats = app.Stats()
+        data = app.scrape("alice", stats=stats, session=self.session)
+        self.assertNotIn("timing", data)
+        self.assertEqual([stats.timers[stage][0] for stage in ("fetch", "extract", "parse")], [1, 1, 1])
+        self.assertEqual(stats.counters["bytes_fetched"], len(self.upstream.pages["alice"].encode()))
+        self.assertEqual(stats.counters["profiles"], 1)
+
+    def test_cache_and_retry_counters(self):
+        stats = app.Stats()
+        cache = app.ResponseCache(self.tmp.name, ttl=0)
+        self.upstream.failures["alice"] = [(503, {})]
+        retry = app.RetryPolicy(retries=1, backoff=0)
+        for _ in range(2):
+            app.scrape("alice", cache=cache, retry=retry, stats=stats, session=self.session)
+        app.scrape("alice", cache=app.ResponseCache(self.tmp.name, ttl=60), stats=stats, session=self.session)
+        self.assertEqual(stats.counters["retries"], 1)
+        self.assertEqual(stats.counters["cache_misses"], 1)
+        self.assertEqual(stats.counters["cache_revalidated"], 1)
+        self.assertEqual(stats.counters["cache_hits"], 1)
+        with self.assertRaises(app.ProfileNotFound):
+            app.scrape("missing", stats=stats, session=self.session)
+        self.assertEqual(stats.counters["errors"], 1)
+
+    def test_async_scrape_records_stages(self):
+        stats = app.Stats()
+        data = asyncio.run(app.async_scrape("alice", stats=stats, timing=True))
+        self.assertEqual(set(data["timing"]), {"fetch", "extract", "parse"})
+        self.assertEqual(stats.timers["parse"][0], 1)
+        self.assertGreater(stats.counters["bytes_fetched"], 0)
+
+    @patch('builtins.print')
+    def test_main_timing(self, mock_print):
+        app.main(['--username', 'alice', '--timing'])
+        data = json.loads(mock_print.call_args[0][0])
+        self.assertEqual(data["username"], "alice")
+        self.assertEqual(set(data["timing"]), {"fetch", "extract", "parse"})
+
+    @patch('app.sys.stderr', new_callable=io.StringIO)
+    def test_main_stats(self, mock_stderr):
+        names = os.path.join(self.tmp.name, "names.txt")
+        out = os.path.join(self.tmp.name, "out.jsonl")
+        with open(names, "w") as f:
+            f.write("alice\nmissing\n")
+        with self.assertRaises(SystemExit):
+            app.main(['--usernames-file', names, '--outfile', out, '--stats', '--retries', '0'])
+        summary = mock_stderr.getvalue()
+        self.assertIn("1 profile(s), 1 error(s)", summary)
+        self.assertRegex(summary, r"serialize +2 ")
+        with open(out) as f:
+            self.assertNotIn("timing", f.readline())
+
+
 if __name__ == '__main__':
     unittest.main()